@@ -0,0 +1,157 @@
+#!/usr/bin/env python
+
+"""
+Select the parameter sets affected by a range of commits, using the source lines they covered in their last coverage run.
+
+Coverage runs (--coverage) record the source files used by each parameter set in the results database, with the lines
+it covered and the lines which are executable at all. With --affected-by, only the parameter sets which covered a changed
+line are run, as well as those without coverage information. Changed lines without an execution count (declarations,
+constants, templates, mixins) cannot be traced, so they affect every parameter set which used their file.
+The line numbers of the changes refer to the start of the range, so it should start at the revision the coverage was recorded for.
+"""
+
+import glob
+import json
+import os
+import re
+import subprocess
+
+from logging import *
+from results import connectResults, encodeParameters, queryResults, resultsLock
+
+def parseCovLst(path):
+    """ Read a coverage .lst file. Returns the source file it belongs to, the set of line numbers which have been executed, and the set of executable line numbers. """
+    source = None
+    covered = set()
+    executable = set()
+    with open(path) as f:
+        for n, line in enumerate(f):
+            split = line.split("|", 1)
+            if ( len(split) != 2 ):
+                # The last line names the source file, e.g. "src/dlbc/lb/force.d is 85% covered".
+                match = re.match(r"(\S+) (is \d+% covered|has no code)", line.strip())
+                if ( match ):
+                    source = os.path.normpath(match.group(1))
+                continue
+            count = split[0].strip()
+            if ( count != "" ):
+                executable.add(n + 1)
+                if ( int(count) > 0 ):
+                    covered.add(n + 1)
+    return source, covered, executable
+
+def getRevision(dlbcRoot):
+    """ Get the git revision of the DLBC sources, or None if it cannot be determined. """
+    try:
+        return subprocess.check_output([ "git", "rev-parse", "HEAD" ], cwd=dlbcRoot).strip()
+    except ( OSError, subprocess.CalledProcessError ):
+        return None
+
+def recordCoverage(options, thisTest, runRoot, m = None):
+    """ Replace the coverage information of a parameter set by the .lst files it produced in runRoot. """
+    import time
+    parameters = encodeParameters(m)
+    revision = getRevision(options.dlbc_root)
+    timestamp = time.strftime("%Y-%m-%dT%H:%M:%SZ", time.gmtime())
+    rows = []
+    for f in sorted(glob.glob(os.path.join(runRoot, "src*.lst"))):
+        source, covered, executable = parseCovLst(f)
+        if ( source ):
+            rows.append(( thisTest.name, parameters, source, json.dumps(sorted(covered)), json.dumps(sorted(executable)), revision, timestamp ))
+    logDebug("  Recording coverage of %d source files ..." % len(rows))
+    with resultsLock:
+        connection = connectResults(options.dlbc_root)
+        try:
+            with connection:
+                connection.execute("DELETE FROM coverage WHERE test = ? AND parameters = ?", ( thisTest.name, parameters ))
+                connection.executemany("INSERT INTO coverage (test, parameters, file, lines, executable, revision, timestamp) VALUES (?, ?, ?, ?, ?, ?, ?)", rows)
+        finally:
+            connection.close()
+
+def loadCoverage(options):
+    """ Get the source files used by each (test, parameters), as a dictionary of source file to (covered lines, executable lines).
+
+    The executable lines are None for coverage recorded before they were stored.
+    """
+    coverageMap = {}
+    for test, parameters, f, lines, executable in queryResults(options, "SELECT test, parameters, file, lines, executable FROM coverage", ()):
+        if ( executable is not None ):
+            executable = set(json.loads(executable))
+        coverageMap.setdefault(( test, parameters ), {})[f] = ( set(json.loads(lines)), executable )
+    return coverageMap
+
+def getChangedLines(options, commits):
+    """ Get the files changed by a range of commits and their changed lines, numbered as before the change. """
+    command = [ "git", "diff", "--relative", "--no-color", "--no-ext-diff", "--unified=0", commits, "--" ]
+    logDebug("Executing '" + " ".join(command) + "'")
+    try:
+        diff = subprocess.check_output(command, cwd=options.dlbc_root)
+    except ( OSError, subprocess.CalledProcessError ):
+        logFatal("Could not get the changes in '%s' from git." % commits, -1)
+    changes = {}
+    path = None
+    for line in diff.splitlines():
+        if ( line.startswith("--- ") ):
+            path = None
+            if ( line[4:] != "/dev/null" ):
+                path = os.path.normpath(line[6:])
+        elif ( line.startswith("+++ ") ):
+            if ( path is None ):
+                # A new file, which has not been covered by anything.
+                path = os.path.normpath(line[6:])
+            changes.setdefault(path, set())
+        elif ( line.startswith("@@ ") ):
+            match = re.match(r"@@ -(\d+)(?:,(\d+))? ", line)
+            start = int(match.group(1))
+            count = 1
+            if ( match.group(2) is not None ):
+                count = int(match.group(2))
+            if ( count == 0 ):
+                # Lines inserted after line start: count its neighbours as changed.
+                changes[path].update([ start, start + 1 ])
+            else:
+                changes[path].update(range(start, start + count))
+    return changes
+
+def isSourceChange(path):
+    """ Check if a changed file is part of the build but has no line coverage, so that it may affect any test. """
+    return ( ( path.startswith("src" + os.sep) and not path.endswith(".d") ) or path == "dub.json" )
+
+def loadAffected(options):
+    """ Prepare --affected-by: load the changes and the coverage information. Returns False if all tests may be affected. """
+    options.changedLines = getChangedLines(options, options.affected_by)
+    options.coverageMap = loadCoverage(options)
+    logNotification("Found %d changed files in '%s', and coverage information for %d parameter sets." % ( len(options.changedLines), options.affected_by, len(options.coverageMap) ))
+    for path in sorted(options.changedLines):
+        if ( isSourceChange(path) ):
+            logNotification("The change to '%s' may affect all tests, ignoring --affected-by ..." % path)
+            return False
+    return True
+
+def isAffected(options, thisTest, m = None):
+    """ Check if a parameter set is affected by the changes: its test directory changed, it covered a changed line,
+    a line without execution count changed in a file it used, or its coverage is unknown.
+    """
+    testPath = os.path.relpath(os.path.realpath(thisTest.testRoot), os.path.realpath(options.dlbc_root))
+    for path in options.changedLines:
+        if ( path == testPath or path.startswith(testPath + os.sep) ):
+            return True
+    covered = options.coverageMap.get(( thisTest.name, encodeParameters(m) ))
+    if ( covered is None ):
+        return True
+    for path, lines in options.changedLines.items():
+        if ( path not in covered ):
+            continue
+        coveredLines, executableLines = covered[path]
+        if ( executableLines is None or ( lines - executableLines ) ):
+            return True
+        if ( coveredLines & lines ):
+            return True
+    return False
+
+def isAffectedTest(options, thisTest):
+    """ Check if any parameter set of a test is affected by the changes. """
+    from run import mapParameterMatrix
+    if ( thisTest.parameters ):
+        return any([ isAffected(options, thisTest, m) for m in mapParameterMatrix(thisTest) ])
+    return isAffected(options, thisTest)
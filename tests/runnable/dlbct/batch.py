@@ -0,0 +1,148 @@
+#!/usr/bin/env python
+
+"""
+Run short parameter sets of several tests together in MPMD launches, to save the startup and teardown time of mpirun.
+
+Each program of a launch runs in its own directory through mpmd-wrapper.py, which records the return code, run time and
+resource usage of every rank, so they can be attributed to the parameter set the program belongs to. DLBC gives each
+program of an MPMD launch its own communicator. Programs without a complete record, e.g. because the launch was killed
+after another program failed, are run again on their own, unless the launch timed out: then they count as timed out.
+"""
+
+import glob
+import json
+import os
+import shutil
+import sys
+
+from history import estimateSubtest
+from logging import *
+from path import *
+from run import checkSubtest, failureLimitReached, finishRunRoot, getSubtestNP, getTimeout, launchCommand, mapParameterMatrix, \
+    orderParameterSets, populateRunRoot, prepareDLBCCommand, prepareSubtestCommand, recordFailedParameterSet, runSubtest, \
+    skipParameterSet, sumResources
+
+# Largest number of programs in a single launch.
+batchSize = 16
+
+def isBatchable(options, thisTest):
+    """ Check if all parameter sets of a test took less than --batch seconds last time, and fit into the core budget. """
+    if ( thisTest.parameters ):
+        maps = list(mapParameterMatrix(thisTest))
+    else:
+        maps = [ None ]
+    for m in maps:
+        estimate = estimateSubtest(options.timings, thisTest, m)
+        if ( estimate is None or estimate > options.batch or getSubtestNP(thisTest, m) > options.cores ):
+            return False
+    return True
+
+def planBatches(options, tests):
+    """ Group the parameter sets of tests into batches, whose ranks add up to at most the number of cores. Returns lists of (test, index, parameter set). """
+    batches = []
+    batch = []
+    ranks = 0
+    for test in tests:
+        for i, m in orderParameterSets(options, test):
+            np = getSubtestNP(test, m)
+            if ( batch and ( ranks + np > options.cores or len(batch) >= batchSize ) ):
+                batches.append(batch)
+                batch = []
+                ranks = 0
+            batch.append(( test, i, m ))
+            ranks += np
+    if ( batch ):
+        batches.append(batch)
+    return batches
+
+def getTimeoutBatch(options, batch):
+    """ Get the timeout for a batch: the longest timeout of its parameter sets, or None if any of them has no limit. """
+    timeouts = [ getTimeout(options, test) for test, i, m in batch ]
+    if ( not all(timeouts) ):
+        return None
+    return max(timeouts)
+
+def readStatus(runRoot):
+    """ Read and remove the records written by mpmd-wrapper.py for the ranks of a program. """
+    records = []
+    for f in sorted(glob.glob(os.path.join(runRoot, "mpmd-status-*.json"))):
+        with open(f) as status:
+            records.append(json.load(status))
+        os.remove(f)
+    return records
+
+def shareResources(resources, np, nRanks):
+    """ Attribute the share of np of nRanks ranks of the times and bytes of a launch to one of its programs; the peak memory is that of the launch. """
+    share = dict(resources)
+    for key in [ "utime", "stime" ]:
+        share[key] = resources[key] * np / float(nRanks)
+    for key in [ "readBytes", "writeBytes" ]:
+        share[key] = resources[key] * np // nRanks
+    return share
+
+def executeBatch(options, batch):
+    """ Run the parameter sets of a batch which are not skipped in a single MPMD launch. Returns the list of (test, index, parameter set, run directory) to postprocess. """
+    members = []
+    for test, i, m in batch:
+        if ( not test.prepared or skipParameterSet(options, test, i, m, getSubtestNP(test, m)) ):
+            continue
+        runRoot = constructBatchPath(options.dlbc_root, test.name, i)
+        populateRunRoot(test, runRoot)
+        members.append(( test, i, m, runRoot ))
+    if ( not members ):
+        return []
+
+    wrapper = os.path.join(os.path.dirname(os.path.realpath(__file__)), "mpmd-wrapper.py")
+    command = [ "mpirun" ]
+    for test, i, m, runRoot in members:
+        if ( len(command) > 1 ):
+            command.append(":")
+        command += [ "-np", str(test.np), "-wdir", runRoot, sys.executable, wrapper ] + prepareDLBCCommand(options, test, m)
+    logNotification("Running %d parameter sets in a single launch ..." % len(members))
+    timeout = getTimeoutBatch(options, batch)
+    returncode, timeElapsed, resources, killed = launchCommand(command, constructBatchRoot(options.dlbc_root), timeout)
+    logInformation("  The launch took %f seconds." % timeElapsed)
+
+    nRanks = sum([ test.np for test, i, m, runRoot in members ])
+    finished = []
+    for test, i, m, runRoot in members:
+        records = readStatus(runRoot)
+        if ( len(records) == test.np ):
+            logInformation("  Parameter set %d of %d of test '%s':" % ( i + 1, test.nSubtests, test.name ))
+            test.timers[i] = max([ r["time"] for r in records ])
+            test.returncodes[i] = 0
+            for r in records:
+                if ( r["returncode"] != 0 ):
+                    test.returncodes[i] = r["returncode"]
+                    break
+            for r in records:
+                r["timedOut"] = False
+            test.resources[i] = sumResources(records)
+            failed = checkSubtest(test, i, None)
+        elif ( killed == "aborted" or failureLimitReached.is_set() ):
+            failed = checkSubtest(test, i, "aborted")
+        elif ( killed == "timedOut" ):
+            # Running the program again on its own would most likely only time out once more.
+            logInformation("  Parameter set %d of %d of test '%s':" % ( i + 1, test.nSubtests, test.name ))
+            test.timers[i] = timeElapsed
+            test.returncodes[i] = returncode
+            test.resources[i] = shareResources(resources, test.np, nRanks)
+            failed = checkSubtest(test, i, killed, timeout)
+        else:
+            # The program was cut short by the failure of another program, run it again to attribute the result properly.
+            logNotification("  Running parameter set %d of %d of test '%s' on its own ..." % ( i + 1, test.nSubtests, test.name ))
+            populateRunRoot(test, runRoot)
+            failed = runSubtest(prepareSubtestCommand(options, test, m), test, i, runRoot, getTimeout(options, test))
+        if ( test.skipped[i] ):
+            finishRunRoot(test, runRoot)
+        elif ( failed ):
+            recordFailedParameterSet(options, test, i, m, runRoot)
+        else:
+            finished.append(( test, i, m, runRoot ))
+    return finished
+
+def cleanBatches(options):
+    """ Remove the directory of the MPMD batches, once all of them have been postprocessed. """
+    batchRoot = constructBatchRoot(options.dlbc_root)
+    if ( os.path.exists(batchRoot) ):
+        shutil.rmtree(batchRoot)
@@ -4,15 +4,48 @@
 Wrappers for the dub build process for DLBC.
 """
 
+import hashlib
+import json
 import os
 import shutil
 import subprocess
+import threading
 
 from logging import *
 from path import *
+from results import loadBuildTimes, queryResults, recordBuild
 
 buildTimers = {}
 
+# Guards builtExecutables, buildLocks and the executable cache.
+buildLock = threading.Lock()
+# One lock per executable: different executables are built in their own directories and may be built at the same time.
+buildLocks = {}
+# Executables built during this run, which are not rebuilt even if a forced build is requested.
+builtExecutables = set()
+# Largest number of dub builds which ran at the same time as each build in progress, by executable path. Guarded by buildLock.
+activeBuilds = {}
+
+# Largest total size in bytes of the cached executables; 0 disables the cache. Set by --exe-cache-size.
+exeCacheSize = 4096 * 1024 * 1024
+# Builds are compared to the median time of this many previous builds of the same executable, if there are at least buildWindowMin.
+buildWindow = 10
+buildWindowMin = 3
+# Percentage by which a build may be slower than that median before it is flagged. Set by --build-regression.
+buildRegression = 25.0
+# Builds of this run which have been flagged, as ( time, median, source hash ) by executable name.
+buildRegressions = {}
+
+# Files and directories below dlbcRoot which are copied into the working directory of a build.
+buildCopies = [ "src", "unstandard", "dub.json", "dub.selections.json", "get-revision.sh", "get-plugin-modules.sh" ]
+# Directories below those which belong to dub or git rather than the sources, and are not copied.
+buildIgnores = [ ".dub", ".git" ]
+# Files generated by the preGenerateCommands of dub.json, which change with every build and do not determine it.
+generatedSources = [ os.path.join("src", "dlbc", "revision.d"), os.path.join("src", "dlbc", "plugins", "plist.d") ]
+# Hashes of the sources and versions of the compilers, determined once per run.
+sourceDigests = {}
+compilerVersions = {}
+
 dubCompilerChoices = [ "dmd", "gdc", "ldc2" ]
 dubBuildChoices = [ "release", "cov", "unittest-cov", "profile" ]
 dubBuildBuildAll = [ "release", "cov", "unittest-cov" ]
@@ -46,45 +79,321 @@ def buildDoc(compiler, dlbcRoot):
     if ( p.returncode != 0 ):
         logFatal("Dub build command returned %d." % p.returncode, p.returncode)
 
+def getCompilerVersion(compiler):
+    """ Get the version output of a compiler, or an empty string if it cannot be run. """
+    if ( compiler not in compilerVersions ):
+        try:
+            compilerVersions[compiler] = subprocess.check_output([ compiler, "--version" ], stderr=subprocess.STDOUT)
+        except ( OSError, subprocess.CalledProcessError ):
+            logDebug("  Could not determine the version of compiler '%s'." % compiler)
+            compilerVersions[compiler] = ""
+    return compilerVersions[compiler]
+
+def listSourceFiles(dlbcRoot):
+    """ List the files which are copied into the working directory of a build, relative to dlbcRoot. """
+    paths = []
+    for name in buildCopies:
+        path = os.path.join(dlbcRoot, name)
+        if ( os.path.isfile(path) ):
+            paths.append(name)
+        for root, dirnames, filenames in os.walk(path):
+            dirnames[:] = [ d for d in dirnames if d not in buildIgnores ]
+            paths += [ os.path.relpath(os.path.join(root, f), dlbcRoot) for f in filenames ]
+    return sorted(paths)
+
+def getSourceDigest(dlbcRoot):
+    """ Hash the files which determine a build: everything that is copied into its working directory. """
+    if ( dlbcRoot not in sourceDigests ):
+        digest = hashlib.sha1()
+        for path in listSourceFiles(dlbcRoot):
+            filePath = os.path.join(dlbcRoot, path)
+            if ( path in generatedSources or not os.path.isfile(filePath) ):
+                continue
+            digest.update(path + "\0")
+            with open(filePath, "rb") as f:
+                digest.update(f.read())
+            digest.update("\0")
+        sourceDigests[dlbcRoot] = digest.hexdigest()
+    return sourceDigests[dlbcRoot]
+
+def getBuildKey(compiler, build, configuration, dlbcRoot):
+    """ Identify an executable by the sources, compiler version, build type and configuration it is built from. """
+    digest = hashlib.sha1()
+    digest.update("\0".join([ getSourceDigest(dlbcRoot), compiler, getCompilerVersion(compiler), build, configuration ]))
+    return digest.hexdigest()[:16]
+
+def resetBuilds():
+    """ Forget the executables built and the sources hashed during this run, e.g. after the sources have changed. """
+    with buildLock:
+        builtExecutables.clear()
+        sourceDigests.clear()
+
+def installExecutable(source, target):
+    """ Hard link or copy an executable to target, replacing it atomically so running tests keep the old one. """
+    # Renaming a hard link onto another link to the same file does nothing and would leave the temporary link behind.
+    if ( os.path.exists(target) and os.path.samefile(source, target) ):
+        return
+    temporaryPath = "%s.%d" % ( target, os.getpid() )
+    if ( os.path.lexists(temporaryPath) ):
+        os.remove(temporaryPath)
+    try:
+        os.link(source, temporaryPath)
+    except OSError:
+        shutil.copy2(source, temporaryPath)
+    os.rename(temporaryPath, target)
+
+def evictExecutables(dlbcRoot, keep):
+    """ Remove the least recently used executables from the cache until it fits into exeCacheSize. """
+    cacheRoot = constructExeCacheRoot(dlbcRoot)
+    entries = []
+    for name in os.listdir(cacheRoot):
+        path = os.path.join(cacheRoot, name)
+        try:
+            stat = os.stat(path)
+        except OSError:
+            continue
+        entries.append(( stat.st_mtime, stat.st_size, path ))
+    total = sum([ e[1] for e in entries ])
+    for mtime, size, path in sorted(entries):
+        if ( total <= exeCacheSize ):
+            break
+        if ( path == keep ):
+            continue
+        logInformation("  Evicting executable '%s' from the cache." % path)
+        try:
+            os.remove(path)
+        except OSError:
+            continue
+        total -= size
+
+def getBuildLock(exePath):
+    """ Get the lock which serialises the builds of an executable. """
+    with buildLock:
+        return buildLocks.setdefault(exePath, threading.Lock())
+
 def dubBuild(compiler, build, configuration, force, dlbcRoot):
-    """ Build a DLBC executable for a particular compiler/build/configuration, if needed. """
-    import dlbct.logging
+    """ Build a DLBC executable for a particular compiler/build/configuration, if needed.
+
+    Executables are cached, keyed by a hash of the sources, the compiler version and the build type and configuration,
+    and the matching one is installed as the target executable. Unless force is set, a cached executable is reused.
+    With the cache disabled, an existing target executable is reused instead, whether or not it is up to date.
+    """
     logNotification("Preparing executable '%s' ..." % constructExeTargetName(configuration, build, compiler))
     exePath = constructExeTargetPath(configuration, build, compiler, dlbcRoot)
-    if ( not force ):
-        if ( os.path.isfile(exePath) ):
-            logInformation("  Found executable '%s'." % exePath )
-            return
+    with getBuildLock(exePath):
+        with buildLock:
+            if ( exePath in builtExecutables ):
+                logInformation("  Found executable '%s' (built during this run)." % exePath )
+                return
+        if ( exeCacheSize <= 0 ):
+            if ( not force and os.path.isfile(exePath) ):
+                logInformation("  Found executable '%s'." % exePath )
+                return
+            runDubBuild(compiler, build, configuration, dlbcRoot, exePath)
+        else:
+            cachePath = constructExeCachePath(configuration, build, compiler, getBuildKey(compiler, build, configuration, dlbcRoot), dlbcRoot)
+            if ( not force and os.path.isfile(cachePath) ):
+                logInformation("  Found executable '%s' in the cache." % os.path.basename(cachePath) )
+                with buildLock:
+                    # Mark the executable as recently used.
+                    os.utime(cachePath, None)
+                    installExecutable(cachePath, exePath)
+            else:
+                runDubBuild(compiler, build, configuration, dlbcRoot, exePath)
+                with buildLock:
+                    if ( not os.path.isdir(os.path.dirname(cachePath)) ):
+                        os.makedirs(os.path.dirname(cachePath))
+                    installExecutable(exePath, cachePath)
+                    evictExecutables(dlbcRoot, cachePath)
+        with buildLock:
+            builtExecutables.add(exePath)
+
+def createBuildJobs(options, configurations):
+    """ Create a job to build the executable of each configuration for the current compiler and build type.
+
+    At most --build-jobs of the jobs run at a time, started in the order of configurations.
+    Returns a dictionary of the jobs by configuration.
+    """
+    from schedule import Job
+    jobs = {}
+    order = []
+    for c in configurations:
+        job = Job("build " + constructExeTargetName(c, options.dub_build, options.dub_compiler), 1, dubBuild,
+                  options.dub_compiler, options.dub_build, c, options.dub_force, options.dlbc_root)
+        if ( len(order) >= options.build_jobs ):
+            job.dependsOn(order[-options.build_jobs])
+        order.append(job)
+        jobs[c] = job
+    return jobs
+
+def buildAhead(options, configurations):
+    """ Build the executables of configurations in a background thread, in order, while the tests run one after the other.
+
+    A test waits for the build of its executable if it is still in progress. If a build fails, the test which needs it builds it
+    again and reports the failure.
+    """
+    from schedule import Scheduler
+    jobs = createBuildJobs(options, configurations)
+    thread = threading.Thread(target=Scheduler(options.build_jobs).run, args=([ jobs[c] for c in configurations ],))
+    thread.daemon = True
+    thread.start()
+
+def getDubPackagesPath():
+    """ Get the directory in which dub keeps the packages it has fetched for the user. """
+    if ( "DUB_HOME" in os.environ ):
+        return os.path.join(os.environ["DUB_HOME"], "packages")
+    return os.path.join(os.path.expanduser("~"), ".dub", "packages")
+
+def listDubPackages(dlbcRoot):
+    """ List the directories of the fetched packages selected in dub.selections.json, relative to the dub packages directory.
+
+    Dub keeps a package either in <name>-<version> or, since dub 1.31, in <name>/<version>. Returns None if there is no
+    selection, in which case all packages are needed.
+    """
+    try:
+        with open(os.path.join(dlbcRoot, "dub.selections.json")) as f:
+            versions = json.load(f)["versions"]
+    except ( IOError, ValueError, KeyError ):
+        return None
+    packagesPath = getDubPackagesPath()
+    paths = []
+    for name, version in sorted(versions.items()):
+        if ( not isinstance(version, basestring) ):
+            # Packages taken from a path or repository are not in the package cache.
+            continue
+        for path in [ "%s-%s" % ( name, version ), os.path.join(name, version) ]:
+            if ( os.path.isdir(os.path.join(packagesPath, path)) ):
+                paths.append(path)
+    return paths
+
+def prepareBuildRoot(dlbcRoot, buildRoot):
+    """ Set up a working directory for a dub build which runs next to another one, with its own copy of the sources and of the fetched dub packages.
 
+    The sources are copied rather than linked, because dub writes revision.d and plist.d into them before every build.
+    Dub builds the dependencies inside their package directories, so concurrent builds which shared the packages of the
+    user would build e.g. hdf5-d into the same directory at the same time. Each build gets a copy of the selected
+    packages in the local package cache of its working directory instead, which dub looks in first.
+    """
+    if ( os.path.lexists(buildRoot) ):
+        shutil.rmtree(buildRoot)
+    os.makedirs(buildRoot)
+    for name in buildCopies:
+        path = os.path.join(dlbcRoot, name)
+        if ( os.path.isdir(path) ):
+            shutil.copytree(path, os.path.join(buildRoot, name), ignore=shutil.ignore_patterns(*buildIgnores))
+        elif ( os.path.isfile(path) ):
+            shutil.copy2(path, os.path.join(buildRoot, name))
+    packagesPath = getDubPackagesPath()
+    if ( not os.path.isdir(packagesPath) ):
+        return
+    packages = listDubPackages(dlbcRoot)
+    if ( packages is None ):
+        shutil.copytree(packagesPath, os.path.join(buildRoot, ".dub", "packages"), symlinks=True, ignore=shutil.ignore_patterns(".dub"))
+        return
+    for path in packages:
+        shutil.copytree(os.path.join(packagesPath, path), os.path.join(buildRoot, ".dub", "packages", path), symlinks=True, ignore=shutil.ignore_patterns(".dub"))
+
+def runDubBuild(compiler, build, configuration, dlbcRoot, exePath):
+    """ Execute dub to build a DLBC executable, and move it to exePath.
+
+    A build runs in the DLBC root unless another build is in progress, in which case it gets a working directory of its own.
+    """
+    import dlbct.logging
     logInformation("  Building executable '%s' ..." % exePath)
-    command = ["dub", "build", "--compiler", compiler, "-b", build, "-c", configuration, "--force"]
-    if ( dlbct.logging.verbosityLevel < 6 ):
-        command.append("--vquiet")
-    logDebug("  Executing '" + " ".join(command) + "'.")
-    p = subprocess.Popen(command, cwd=dlbcRoot)
-    p.communicate()
-    if ( p.returncode != 0 ):
-        logFatal("Dub build command returned %d." % p.returncode, p.returncode)
-    shutil.move(os.path.join(dlbcRoot, "dlbc-" + configuration), exePath)
+    with buildLock:
+        activeBuilds[exePath] = 0
+        running = len(activeBuilds)
+        for path in activeBuilds:
+            activeBuilds[path] = max(activeBuilds[path], running)
+        isolated = ( running > 1 )
+    try:
+        command = ["dub", "build", "--compiler", compiler, "-b", build, "-c", configuration, "--force"]
+        buildRoot = dlbcRoot
+        if ( isolated ):
+            buildRoot = constructBuildPath(configuration, build, compiler, dlbcRoot)
+            prepareBuildRoot(dlbcRoot, buildRoot)
+            # Packages which still have to be fetched go into the local package cache as well.
+            command.append("--cache=local")
+        if ( dlbct.logging.verbosityLevel < 6 ):
+            command.append("--vquiet")
+        logDebug("  Executing '" + " ".join(command) + "' in '%s'." % buildRoot)
+        import time
+        t0 = time.time()
+        p = subprocess.Popen(command, cwd=buildRoot)
+        p.communicate()
+        if ( p.returncode != 0 ):
+            if ( isolated ):
+                logFatal("Dub build command returned %d, its working directory '%s' has been kept." % ( p.returncode, buildRoot ), p.returncode)
+            logFatal("Dub build command returned %d." % p.returncode, p.returncode)
+        buildTime = time.time() - t0
+        with buildLock:
+            concurrency = activeBuilds[exePath]
+        recordBuildTime(compiler, build, configuration, dlbcRoot, buildTime, concurrency)
+        shutil.move(os.path.join(buildRoot, "dlbc-" + configuration), exePath)
+    finally:
+        with buildLock:
+            del activeBuilds[exePath]
+    if ( isolated ):
+        shutil.rmtree(buildRoot)
+        try:
+            os.rmdir(constructBuildRoot(dlbcRoot))
+        except OSError:
+            # Other builds are still running, or have failed and kept their working directory.
+            pass
+
+def getMedian(values):
+    """ Get the median of a non-empty list of numbers. """
+    values = sorted(values)
+    n = len(values)
+    if ( n % 2 == 1 ):
+        return values[n // 2]
+    return 0.5 * ( values[n // 2 - 1] + values[n // 2] )
+
+def checkBuildRegression(buildTime, previous):
+    """ Get the median of the previous build times if buildTime exceeds it by more than buildRegression percent, None otherwise. """
+    if ( len(previous) < buildWindowMin ):
+        return None
+    median = getMedian(previous)
+    if ( buildTime > median * ( 1.0 + buildRegression / 100.0 ) ):
+        return median
+    return None
+
+def recordBuildTime(compiler, build, configuration, dlbcRoot, buildTime, concurrency):
+    """ Store the time of a build in the results database, and flag it if it is much slower than the builds before it.
+
+    The concurrency is the largest number of builds which ran at the same time as this one; builds only compete for the
+    cores with other builds, so a build is only compared to previous builds with the same concurrency.
+    """
+    from affected import getRevision
+    sourceHash = getSourceDigest(dlbcRoot)
+    median = checkBuildRegression(buildTime, loadBuildTimes(dlbcRoot, compiler, build, configuration, concurrency, buildWindow))
+    if ( median is not None ):
+        buildRegressions[constructExeTargetName(configuration, build, compiler)] = ( buildTime, median, sourceHash )
+        logNotification("  The build took %f seconds, %.0f%% longer than the median of the previous builds with %d concurrent build(s) (%f seconds), for sources %s." %
+                        ( buildTime, 100.0 * ( buildTime / median - 1.0 ), concurrency, median, sourceHash ))
+    recordBuild(dlbcRoot, compiler, build, configuration, sourceHash, getRevision(dlbcRoot), buildTime, concurrency)
 
 def buildAll(options):
-    """ Build all combinations of build type and configuration for the current compiler. """
-    nCombinations = len(dlbcConfigurations) * len(dubBuildBuildAll)
-    n = 1
+    """ Build all combinations of build type and configuration for the current compiler, running --build-jobs builds at a time. """
+    from schedule import Job, Scheduler
     import time
-    for c in dlbcConfigurations:
-        for b in dubBuildBuildAll:
-            logNotification("Building executable %d of %d ..." % ( n, nCombinations) )
-            t0 = time.time()
-            dubBuild(options.dub_compiler, b, c, options.dub_force, options.dlbc_root)
-            timeElapsed = time.time() - t0
-            timerName = constructExeTargetName(c, b, options.dub_compiler)
-            buildTimers[timerName] = timeElapsed
-            logInformation("  Took %f seconds." % timeElapsed)
-            n += 1
-
-def reportBuildTimers(warnTime):
-    """ Report on the contents of the buildTimers dictionary. """
+    combinations = [ ( c, b ) for c in dlbcConfigurations for b in dubBuildBuildAll ]
+
+    def buildOne(n, c, b):
+        logNotification("Building executable %d of %d ..." % ( n, len(combinations) ) )
+        t0 = time.time()
+        dubBuild(options.dub_compiler, b, c, options.dub_force, options.dlbc_root)
+        timeElapsed = time.time() - t0
+        buildTimers[constructExeTargetName(c, b, options.dub_compiler)] = timeElapsed
+        logInformation("  Took %f seconds." % timeElapsed)
+
+    jobs = [ Job(constructExeTargetName(c, b, options.dub_compiler), 1, buildOne, n + 1, c, b) for n, ( c, b ) in enumerate(combinations) ]
+    t0 = time.time()
+    Scheduler(options.build_jobs).run(jobs)
+    return time.time() - t0
+
+def reportBuildTimers(warnTime, wallTime=None):
+    """ Report on the contents of the buildTimers dictionary, and the wall time of all builds if it is given. """
     bnlen = max([len(t) for t in buildTimers])
 
     logNotification("\n" + "="*80 + "\n")
@@ -96,7 +405,9 @@ def reportBuildTimers(warnTime):
     for build in sorted(buildTimers):
         time = buildTimers[build]
         totalTime += time
-        if ( time > warnTime ):
+        if ( build in buildRegressions ):
+            logNotification("R %*s %12e" % (bnlen, build, time))
+        elif ( time > warnTime ):
             logNotification("! %*s %12e" % (bnlen, build, time))
             warnings += 1
         else:
@@ -109,6 +420,9 @@ def reportBuildTimers(warnTime):
 
     logNotification("  %*s %12e" % (bnlen, "total", totalTime))
     logNotification("  %*s %12s" % (bnlen, "", fTime))
+    if ( wallTime is not None ):
+        logNotification("  %*s %12e" % (bnlen, "wall", wallTime))
+        logNotification("  %*s %12s" % (bnlen, "", time.strftime("%H:%M:%S", time.gmtime(wallTime))))
 
     if ( warnings > 0 ):
         if ( warnings == 1 ):
@@ -117,5 +431,51 @@ def reportBuildTimers(warnTime):
             logNotification("Encountered %d time warnings." % warnings)
     else:
         logNotification("Encountered zero time warnings.")
+    if ( buildRegressions ):
+        logNotification("Encountered %d build(s) more than %.0f%% slower than the median of their previous builds:" % ( len(buildRegressions), buildRegression ))
+        for build in sorted(buildRegressions):
+            buildTime, median, sourceHash = buildRegressions[build]
+            logNotification("  %s took %f seconds instead of %f seconds, for sources %s." % ( build, buildTime, median, sourceHash ))
+
+def reportBuildHistory(options):
+    """ Report the trend of the build time of each executable, and flag the builds which were much slower than the ones before them. """
+    rows = queryResults(options, "SELECT compiler, build, configuration, source_hash, revision, build_time, timestamp, COALESCE(concurrency, 1) FROM builds ORDER BY id", ())
+    if ( not rows ):
+        logNotification("No builds have been recorded yet.")
+        return
+    # Builds which ran alongside a different number of other builds are not comparable, so they get a history of their own.
+    history = {}
+    for compiler, build, configuration, sourceHash, revision, buildTime, timestamp, concurrency in rows:
+        history.setdefault(( constructExeTargetName(configuration, build, compiler), concurrency ), []).append(( buildTime, sourceHash, revision, timestamp ))
+
+    bnlen = max([ len(b) for b, c in history ])
+    logNotification("\n" + "="*80 + "\n")
+    logNotification("  %*s %4s %6s %12s %12s %12s %8s" % ( bnlen, "build", "jobs", "builds", "earlier (s)", "recent (s)", "last (s)", "trend" ))
+    logNotification("%s" % "_"*(bnlen+63))
+    regressions = []
+    for build, concurrency in sorted(history):
+        times = [ h[0] for h in history[( build, concurrency )] ]
+        for k, ( buildTime, sourceHash, revision, timestamp ) in enumerate(history[( build, concurrency )]):
+            median = checkBuildRegression(buildTime, times[max(0, k - buildWindow):k])
+            if ( median is not None ):
+                regressions.append(( build, concurrency, timestamp, buildTime, median, sourceHash, revision ))
+        # The trend compares the median of the most recent builds to that of as many builds before them, up to buildWindow each.
+        half = min(buildWindow, len(times) // 2)
+        if ( half == 0 ):
+            logNotification("  %*s %4d %6d %12s %12s %12e %8s" % ( bnlen, build, concurrency, len(times), "---", "---", times[-1], "---" ))
+            continue
+        earlier = getMedian(times[-2*half:-half])
+        recent = getMedian(times[-half:])
+        logNotification("  %*s %4d %6d %12e %12e %12e %+7.0f%%" % ( bnlen, build, concurrency, len(times), earlier, recent, times[-1], 100.0 * ( recent / earlier - 1.0 ) ))
+    logNotification("%s" % "_"*(bnlen+63))
+
+    if ( regressions ):
+        logNotification("Encountered %d build(s) more than %.0f%% slower than the median of the %d builds before them with the same concurrency:" %
+                        ( len(regressions), buildRegression, buildWindow ))
+        for build, concurrency, timestamp, buildTime, median, sourceHash, revision in regressions:
+            logNotification("  %s %s (%d concurrent build(s)) took %f seconds instead of %f seconds (%+.0f%%), for sources %s (revision %s)." %
+                            ( timestamp, build, concurrency, buildTime, median, 100.0 * ( buildTime / median - 1.0 ), sourceHash, revision ))
+    else:
+        logNotification("Encountered zero build time regressions.")
 
 
@@ -0,0 +1,74 @@
+#!/usr/bin/env python
+
+"""
+Catalog of the HDF5 files written by DLBC, so a directory is listed once instead of being globbed for every file.
+
+DLBC names its output files <field>-<simulationName>-<simulationId>-tNNNNNNNN.h5 (see makeFilenameOutput in
+src/dlbc/io/io.d), where the simulation id is a time stamp like 20150303T160546. A catalog parses the names into
+(field, simulation name, simulation id, timestep) and indexes the files of each directory by their field and timestep,
+so looking up the files of a field at a literal timestep only matches the few files with that key. Both the fields and
+the simulation names may contain dashes, so the catalog has to be given the names of the fields to tell them apart.
+"""
+
+import fnmatch
+import glob
+import os
+import re
+
+outputName = re.compile(r"^(?P<prefix>.+?)(?:-(?P<id>\d{8}T\d{6}))?-t(?P<timestep>\d{8,})\.h5$")
+timestepSuffix = re.compile(r"t(\d{8,})\.h5$")
+
+def parseOutputName(fileName, fields):
+    """ Parse the name of an output file into (field, simulation name, simulation id, timestep), or return None.
+
+    The field is the longest of fields the name starts with, followed by a dash; names which start with none of them
+    are not parsed. Files written without a simulation id have an id of None.
+    """
+    match = outputName.match(os.path.basename(fileName))
+    if ( not match ):
+        return None
+    prefix = match.group("prefix")
+    for field in sorted(fields, key=len, reverse=True):
+        if ( prefix.startswith(field + "-") ):
+            return ( field, prefix[len(field) + 1:], match.group("id"), int(match.group("timestep")) )
+    return None
+
+class Catalog:
+
+    def __init__(self, root, fields=()):
+        """ A catalog of the files below root, whose names are parsed for the given fields. Each directory is listed the first time it is looked up. """
+        self.root = root
+        self.fields = list(fields)
+        self.directories = {}
+
+    def getDirectory(self, directory):
+        """ Get the sorted file names of a directory relative to root, and the names indexed by ( field, timestep ). """
+        if ( directory not in self.directories ):
+            try:
+                names = sorted(os.listdir(os.path.join(self.root, directory)))
+            except OSError:
+                names = []
+            keys = {}
+            for name in names:
+                parsed = parseOutputName(name, self.fields)
+                if ( parsed ):
+                    keys.setdefault(( parsed[0], parsed[3] ), []).append(name)
+            self.directories[directory] = ( names, keys )
+        return self.directories[directory]
+
+    def match(self, pattern, field=None):
+        """ Find the paths of the files matching a shell pattern relative to root, in sorted order, like glob.glob would.
+
+        If the pattern is for the output of one of the fields of the catalog at a literal timestep, only the files with
+        that key are matched against it.
+        """
+        directory, base = os.path.split(pattern)
+        if ( glob.has_magic(directory) ):
+            return sorted(glob.glob(os.path.join(self.root, pattern)))
+        names, keys = self.getDirectory(directory)
+        suffix = timestepSuffix.search(base)
+        if ( field in self.fields and base.startswith(field + "-") and suffix and not glob.has_magic(suffix.group(0)) ):
+            names = keys.get(( field, int(suffix.group(1)) ), [])
+        if ( not base.startswith(".") ):
+            names = [ n for n in names if not n.startswith(".") ]
+        return [ os.path.join(self.root, directory, n) for n in fnmatch.filter(names, base) ]
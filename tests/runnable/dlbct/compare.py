@@ -4,18 +4,27 @@
 Compare test results to its reference data.
 """
 
+from catalog import Catalog
+from h5compare import compareDatasets, formatComparison, formatTolerance, matchDigests
 from logging import *
+from schedule import Job, Scheduler
 
-import glob
 import os
 import string
 import subprocess
 
-def compareSingleTest(options, thisTest):
-    compareTest(options, thisTest, 0, None, None)
+# Error metric of the in-process comparison types.
+comparisonMetrics = {
+    "h5py": "absolute",
+    "relative": "relative",
+    "ulp": "ulp",
+}
 
-def compareTest(options, thisTest, i, m, np):
-    """ Run all necessary comparisons for a single subtest. """
+def compareTest(options, thisTest, i, m, np, runRoot = None):
+    """ Run all necessary comparisons for a single subtest, whose output is found in runRoot (by default the test directory). """
+
+    if ( not runRoot ):
+        runRoot = thisTest.testRoot
 
     logNotification("Comparing test result to reference data ...")
 
@@ -39,6 +48,10 @@ def compareTest(options, thisTest, i, m, np):
         logWarning("Parameter compare does not contain any data.")
         data = []
 
+    # List the output and reference data once for all comparisons, and key their files by the data fields.
+    outputs = Catalog(os.path.join(runRoot, "output"), data)
+    references = Catalog(os.path.join(thisTest.testRoot, "reference-data"), data)
+    tasks = []
     for c in comparisons:
         try:
             ctype = c["type"]
@@ -56,39 +69,35 @@ def compareTest(options, thisTest, i, m, np):
             logDebug("Comparison lacks an 'accuracy' parameter. Assuming no laxness.")
             cacc = None
 
-        if ( ctype == "h5diff" ):
-            for d in data:
-                # Here we replace the %data% token for each item in the data array
-                try:
-                    search = os.path.join(thisTest.testRoot, "output", cfiles.replace("%data%", d))
-                    g1 = glob.glob(search)[0]
-                except IndexError:
-                    logFatal("Could not find any files matching '%s'." % search, -1)
-
-                try:
-                    search = os.path.join(thisTest.testRoot, "reference-data", cfiles.replace("%data%", d))
-                    g2 = glob.glob(search)[0]
-                except IndexError:
-                    logFatal("Could not find any files matching '%s'." % search, -1)
-
-                command = [ "h5diff" ]
-                if ( not options.compare_strict and options.dub_compiler != "dmd" and cacc ):
-                    logDebug("  Applying non-strict accuracy cutoff '%s' ..." % cacc )
-                    command += [ "-d", cacc ]
-                if ( options.compare_lax and options.dub_compiler == "dmd" and cacc ):
-                    logDebug("  Applying lax accuracy cutoff '%s' ..." % cacc )
-                    command += [ "-d", cacc ]
-                command += [ g1, g2, "/OutArray" ]
-
-                logDebug("  Executing '" + " ".join(command) + "'.")
-                p = subprocess.Popen(command)
-                p.communicate()
-                if ( p.returncode != 0 ):
-                    thisTest.errors[i] += 1
-                    logError("h5diff returned %d." % p.returncode)
-        else:
+        try:
+            crel = c["relative-accuracy"]
+        except KeyError:
+            crel = None
+
+        try:
+            cfloor = c["floor"]
+        except KeyError:
+            cfloor = None
+
+        if ( ctype != "h5diff" and ctype not in comparisonMetrics ):
             logFatal("Unknown comparison type '%s'." % ctype)
 
+        for d in data:
+            # The accuracies can be given per item in the data array
+            acc = getAccuracy(options, getFieldValue(cacc, d))
+            rel = getAccuracy(options, getFieldValue(crel, d))
+            # The floor of relative errors is part of the metric rather than a tolerance, so it applies to every compiler.
+            floor = getFieldValue(cfloor, d)
+            if ( ctype in comparisonMetrics ):
+                checkTolerance(acc)
+                checkTolerance(rel)
+                checkTolerance(floor)
+            # Here we replace the %data% token for each item in the data array
+            g1, g2 = findComparisonFiles(outputs, references, cfiles.replace("%data%", d), d)
+            tasks.append(( ctype, g1, g2, acc, rel, floor ))
+
+    runComparisons(options, thisTest, i, tasks)
+
     try:
         cshellscripts = compare["shell"]
     except KeyError:
@@ -100,7 +109,7 @@ def compareTest(options, thisTest, i, m, np):
     for s in cshellscripts:
         command = string.split(s, " ")
         logDebug("  Executing '" + " ".join(command) + "'.")
-        p = subprocess.Popen(command, cwd=thisTest.testRoot)
+        p = subprocess.Popen(command, cwd=runRoot)
         p.communicate()
         if ( p.returncode != 0 ):
             thisTest.errors[i] += 1           
@@ -109,6 +118,128 @@ def compareTest(options, thisTest, i, m, np):
     if ( thisTest.errors[i] == 0 ):
         logInformation("  No errors found.")
 
+def getAccuracy(options, accuracy):
+    """ Get the accuracy to apply to a comparison: by default only for non-dmd compilers, never with --compare-strict, and also for dmd with --compare-lax. """
+    if ( not accuracy ):
+        return None
+    if ( not options.compare_strict and options.dub_compiler != "dmd" ):
+        logDebug("  Applying non-strict accuracy cutoff '%s' ..." % accuracy )
+        return accuracy
+    if ( options.compare_lax and options.dub_compiler == "dmd" ):
+        logDebug("  Applying lax accuracy cutoff '%s' ..." % accuracy )
+        return accuracy
+    return None
+
+def getFieldValue(value, field):
+    """ Get a comparison parameter for a data field, which is either a single value or an object keyed by data field. """
+    if ( isinstance(value, dict) ):
+        return value.get(field)
+    return value
+
+def checkTolerance(tolerance):
+    """ Make sure a tolerance of an in-process comparison is a number. """
+    if ( tolerance is None ):
+        return
+    try:
+        float(tolerance)
+    except ( TypeError, ValueError ):
+        logFatal("Comparison accuracy '%s' is not a number. Please notify the test designer." % tolerance, -1)
+
+def findComparisonFiles(outputs, references, pattern, field):
+    """ Find the first output file and the first reference file of a data field matching a pattern in their catalogs. """
+    found = []
+    for catalog in [ outputs, references ]:
+        g = catalog.match(pattern, field)
+        if ( not g ):
+            logFatal("Could not find any files matching '%s'." % os.path.join(catalog.root, pattern), -1)
+        found.append(g[0])
+    return found
+
+def runComparisons(options, thisTest, i, tasks):
+    """ Run independent comparisons concurrently on up to --compare-jobs threads.
+
+    Each comparison collects its messages instead of logging them, so they are reported in the order of the tasks
+    and the errors are added to the subtest in that order too, however the comparisons finished. The error statistics
+    of the in-process comparisons are kept in thisTest.comparisons, to be recorded with the results.
+    """
+    results = [ None ] * len(tasks)
+
+    def run(k, ctype, g1, g2, acc, rel, floor):
+        results[k] = compareFiles(options, ctype, g1, g2, acc, rel, floor)
+
+    if ( options.compare_jobs > 1 and len(tasks) > 1 ):
+        jobs = [ Job("compare-%s" % os.path.basename(t[1]), 1, run, k, *t) for k, t in enumerate(tasks) ]
+        Scheduler(options.compare_jobs).run(jobs)
+    else:
+        for k, t in enumerate(tasks):
+            run(k, *t)
+
+    for errors, messages, record in results:
+        thisTest.errors[i] += errors
+        if ( record ):
+            thisTest.comparisons[i].append(record)
+        for log, message in messages:
+            log(message)
+
+def compareFiles(options, ctype, g1, g2, acc, rel, floor=None):
+    """ Compare an output file to its reference file.
+
+    Returns the number of errors, a list of (log function, message) and, for in-process comparisons, a record of the
+    error statistics. Without a tolerance, a bitwise identical output passes on the digests alone, only other outputs
+    are compared in full.
+    """
+    metric = comparisonMetrics.get(ctype)
+    if ( not acc and not rel and matchDigests(options.dlbc_root, g1, g2) ):
+        record = None
+        if ( metric ):
+            record = createComparisonRecord(ctype, g1, formatTolerance(metric, floor=floor), None, 0, 0.0, 0.0, 0.0, None)
+        return 0, [ ( logDebug, "  Output '%s' matches the digest of the reference data." % os.path.basename(g1) ) ], record
+    if ( not metric ):
+        errors, messages = runH5diff(g1, g2, acc)
+        return errors, messages, None
+    messages = [ ( logDebug, "  Comparing '%s' to '%s' ..." % ( g1, g2 ) ) ]
+    result = compareDatasets(g1, g2, metric, acc, rel, floor)
+    record = None
+    if ( not result["error"] ):
+        record = createComparisonRecord(ctype, g1, formatTolerance(result["metric"], acc, rel, floor), result["size"], result["overTolerance"],
+                                        result["maxError"], result["meanError"], result["p95Error"], result["location"])
+    if ( result["error"] or result["overTolerance"] > 0 ):
+        messages.append(( logError, "%s: %s" % ( os.path.basename(g1), formatComparison(result, acc, rel, floor) ) ))
+        return 1, messages, record
+    messages.append(( logDebug, "  %s" % formatComparison(result, acc, rel, floor) ))
+    return 0, messages, record
+
+def createComparisonRecord(ctype, g1, tolerance, size, overTolerance, maxError, meanError, p95Error, location):
+    """ Collect the error statistics of a comparison, as they are stored in the results database. """
+    return {
+        "file": os.path.basename(g1),
+        "type": ctype,
+        "tolerance": tolerance,
+        "size": size,
+        "overTolerance": overTolerance,
+        "maxError": maxError,
+        "meanError": meanError,
+        "p95Error": p95Error,
+        "location": location,
+    }
+
+def runH5diff(g1, g2, accuracy):
+    """ Compare the /OutArray datasets of two files with h5diff, keeping its output with the messages. """
+    command = [ "h5diff" ]
+    if ( accuracy ):
+        command += [ "-d", str(accuracy) ]
+    command += [ g1, g2, "/OutArray" ]
+
+    messages = [ ( logDebug, "  Executing '" + " ".join(command) + "'." ) ]
+    p = subprocess.Popen(command, stdout=subprocess.PIPE, stderr=subprocess.STDOUT)
+    output = p.communicate()[0].rstrip()
+    if ( output ):
+        messages.append(( logInformation, output ))
+    if ( p.returncode != 0 ):
+        messages.append(( logError, "h5diff returned %d." % p.returncode ))
+        return 1, messages
+    return 0, messages
+
 def replaceTokensInCompare(compare, parameters, np):
     """ Replace tokens in compare matrix, except %data%. """
     import copy
@@ -6,6 +6,7 @@ Wrapper functions to create and merge code coverage data.
 
 import os
 import shutil
+import threading
 
 from build import *
 from logging import *
@@ -13,13 +14,8 @@ from path import *
 from run import runSubtest
 from test import Unittest
 
-def moveCovLst(dlbcRoot, configuration):
-    """ Move a set of coverage .lst files to the coverage path and add a .tmp suffix. """
-    import glob
-    covpath = constructCoveragePath(dlbcRoot)
-    for f in sorted(glob.glob(os.path.normpath(os.path.join(covpath,"src*.lst")))):
-        nf = os.path.basename(f).replace(".lst", "-" + configuration + ".lst.tmp")
-        shutil.move(f, os.path.join(covpath, nf))
+# Runnable tests executed concurrently all merge into the same coverage files.
+mergeLock = threading.Lock()
 
 def cleanCoverage(options):
     """ Clean (remove) the coverage directory. """
@@ -74,22 +70,22 @@ def mergeCovLst(f1, f2):
             ff1.write(l)
 
 def mergeCovLstsUnittest(options, covpath):
-    """ Merge coverage information generated by running the unittests for different configurations. """
+    """ Merge the coverage information generated by running the unittests for the different configurations into covpath. """
     import glob
     logNotification("    Merging unittest coverage information ...")
 
-    # Rename the .lst files for the first configuration - the others will be merged into this one.
-    for f in sorted(glob.glob(os.path.join(covpath, "src*" + dlbcConfigurations[0] + "*.lst.tmp"))):
-        nf = f.replace(".lst.tmp", ".lst").replace("-" + dlbcConfigurations[0],"")
-        shutil.move(f, os.path.join(covpath, nf))
+    # The .lst files of the first configuration are moved - the others will be merged into these.
+    first = constructUnittestCoveragePath(options.dlbc_root, dlbcConfigurations[0])
+    for f in sorted(glob.glob(os.path.join(first, "src*.lst"))):
+        shutil.move(f, os.path.join(covpath, os.path.basename(f)))
 
-    # Merge the other configurations into the first.
     for c in dlbcConfigurations[1:]:
         for f1 in sorted(glob.glob(os.path.join(covpath, "src*.lst"))):
-            f2 = f1.replace(".lst", "-" + c + ".lst.tmp")
-            mergeCovLst(f1, f2)
-            logDebug("Removing coverage file '" + f2 + "' ...")
-            os.remove(f2)
+            mergeCovLst(f1, os.path.join(constructUnittestCoveragePath(options.dlbc_root, c), os.path.basename(f1)))
+
+    for c in dlbcConfigurations:
+        logDebug("Removing unittest directory '%s' ..." % constructUnittestCoveragePath(options.dlbc_root, c))
+        shutil.rmtree(constructUnittestCoveragePath(options.dlbc_root, c))
 
     logDebug("    Files after merge: %s" % sorted(glob.glob(os.path.join(covpath, "src*.lst"))))
 
@@ -97,30 +93,43 @@ def mergeCovLsts(options, testRoot, covpath):
     """ Merge coverage information for a runnable test into the existing coverage files. """
     import glob
     logNotification("    Merging runnable coverage information ...")
-    for f1 in sorted(glob.glob(os.path.join(covpath, "src*.lst"))):
-        f2 = os.path.join(testRoot, os.path.basename(f1))
-        mergeCovLst(f1, f2)
+    with mergeLock:
+        for f1 in sorted(glob.glob(os.path.join(covpath, "src*.lst"))):
+            f2 = os.path.join(testRoot, os.path.basename(f1))
+            mergeCovLst(f1, f2)
 
 def runUnittests(options):
-    """ Run unittests for all configurations. """
+    """ Run unittests for all configurations, concurrently on up to --jobs cores.
+
+    Each configuration runs in a directory of its own, so the .lst files it writes are kept apart until they are merged.
+    """
+    from schedule import Job, Scheduler
     logNotification("Preparing to run unittests ...")
     covpath = constructCoveragePath(options.dlbc_root)
-    tests = []
     # Make the "tests/coverage" directory
     if ( not os.path.isdir(covpath)):
         os.mkdir(covpath)
-    # Symlink in the src directory so the coverage works
-    if ( not os.path.isdir(os.path.join(covpath, "src"))):
-        os.symlink(os.path.join(options.dlbc_root, "src"), os.path.join(covpath, "src"))
-    for c in dlbcConfigurations:
+
+    def run(c, test):
         exePath = constructExeTargetPath(c, options.dub_build, options.dub_compiler, options.dlbc_root)
-        dubBuild(options.dub_compiler, options.dub_build, c, options.dub_force, options.dlbc_root)
-        logNotification("Running unittests ...")
-        command = [ exePath, "-v", options.dlbc_verbosity, "--version" ]
+        logNotification("Running unittests for configuration '%s' ..." % c)
+        runSubtest([ exePath, "-v", options.dlbc_verbosity, "--version" ], test, 0)
 
-        test = Unittest("unittest-%s" % c, covpath)
+    tests = []
+    buildJobs = createBuildJobs(options, dlbcConfigurations)
+    jobs = [ buildJobs[c] for c in dlbcConfigurations ]
+    for c in dlbcConfigurations:
+        root = constructUnittestCoveragePath(options.dlbc_root, c)
+        if ( os.path.exists(root) ):
+            shutil.rmtree(root)
+        os.mkdir(root)
+        # Symlink in the src directory so the coverage works
+        os.symlink(os.path.join(options.dlbc_root, "src"), os.path.join(root, "src"))
+        test = Unittest("unittest-%s" % c, root)
         tests.append(test)
-        runSubtest(command, test, 0)
-        moveCovLst(options.dlbc_root, c)
+        runJob = Job(test.name, 1, run, c, test)
+        runJob.dependsOn(buildJobs[c])
+        jobs.append(runJob)
+    Scheduler(options.cores).run(jobs)
     mergeCovLstsUnittest(options, covpath)
     return tests
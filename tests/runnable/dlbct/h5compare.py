@@ -0,0 +1,362 @@
+#!/usr/bin/env python
+
+"""
+Compare the datasets of two HDF5 files in-process with h5py and NumPy, reading them a hyperslab at a time.
+
+The hyperslabs follow the chunk layout of the reference and are sized so that a comparison stays below a memory
+ceiling, and the error statistics are reduced slab by slab, so fields of several GB can be compared next to a running
+simulation.
+
+Unlike h5diff, a comparison returns numbers: the largest, mean and 95th percentile error, where the largest occurs,
+and how many values differ by more than the tolerance. Errors are absolute, relative or counted in units in the last
+place (ULPs). h5py and numpy are only needed by tests which use them.
+
+Datasets can also be reduced to a digest of their type, shape and contents. The digests of the reference files are kept
+in a manifest which is committed with them, keyed by the git blob id of each file, so a comparison without tolerance can
+first check whether the output is bitwise identical to the reference without reading the reference at all.
+"""
+
+import hashlib
+import json
+import os
+import subprocess
+import threading
+
+from logging import *
+from path import constructReferenceDigestsPath
+
+# Memory ceiling in bytes for the arrays of a single comparison: its share of --compare-memory, which is the total of all concurrent comparisons.
+slabBytes = 256 * 1024 * 1024
+
+# Number of float64 arrays the size of a slab that a comparison holds at once: both inputs, the errors and temporaries.
+slabArrays = 8
+
+# Share of the memory ceiling given to the HDF5 chunk cache of each file. Slabs smaller than a chunk read the same
+# chunk again and again, which is only cheap if it stays in the cache.
+cacheShare = 8
+
+def openFile(h5py, path):
+    """ Open an HDF5 file for reading, with a chunk cache of 1/cacheShare of the memory ceiling. """
+    try:
+        return h5py.File(path, "r", rdcc_nbytes=max(1 << 20, slabBytes // cacheShare), rdcc_nslots=10007)
+    except TypeError:
+        # h5py before 2.9 cannot set the chunk cache.
+        return h5py.File(path, "r")
+
+def getSlabShape(shape, valueBytes, chunks=None):
+    """ Choose the shape of the hyperslabs to read, such that a slab at valueBytes per value fits into slabBytes next to the chunk caches.
+
+    Slabs extend over the whole of the trailing axes and are cut along the leading axis, in whole HDF5 chunks if
+    possible; if even a single row is too large, the next axis is cut as well, and so on. Cutting an axis only once
+    all leading axes are down to one keeps the slabs in storage (C) order.
+    """
+    limit = max(1, ( slabBytes - 2 * slabBytes // cacheShare ) // max(1, valueBytes))
+    block = list(shape)
+    for axis in range(len(shape)):
+        if ( reduce(lambda x, y: x * y, block, 1) <= limit ):
+            break
+        rest = reduce(lambda x, y: x * y, block[axis + 1:], 1)
+        n = limit // max(1, rest)
+        if ( chunks and n >= chunks[axis] ):
+            n -= n % chunks[axis]
+        block[axis] = max(1, min(shape[axis], n))
+    return block
+
+def iterateSlabs(shape, valueBytes, chunks=None):
+    """ Yield the indices (tuples of slices) of consecutive hyperslabs of a dataset, in storage order, as chosen by getSlabShape. """
+    import itertools
+    block = getSlabShape(shape, valueBytes, chunks)
+    starts = [ range(0, n, b) for n, b in zip(shape, block) ]
+    for start in itertools.product(*starts):
+        yield tuple([ slice(j, min(n, j + b)) for j, n, b in zip(start, shape, block) ])
+
+class ErrorStatistics:
+
+    # Mantissa bits which distinguish the bins of the histogram; percentiles are exact to a relative 2^-mantissaBits.
+    mantissaBits = 7
+    # Binary exponents of the positive finite float64 values.
+    minExponent = -1073
+    maxExponent = 1024
+
+    def __init__(self, numpy):
+        """ Reduce the errors of a comparison slab by slab: their number, sum, maximum and its location, and a histogram. """
+        self.numpy = numpy
+        self.count = 0
+        self.total = 0.0
+        self.maximum = 0.0
+        self.location = None
+        self.zeros = 0
+        self.infinities = 0
+        self.bins = 1 << self.mantissaBits
+        self.histogram = numpy.zeros(( self.maxExponent - self.minExponent + 1 ) * self.bins, dtype=numpy.int64)
+
+    def add(self, errors, offset):
+        """ Add the errors of a slab, whose first value is at the index offset of the dataset. """
+        numpy = self.numpy
+        if ( errors.size == 0 ):
+            return
+        self.count += errors.size
+        self.total += float(numpy.sum(errors))
+        k = int(numpy.argmax(errors))
+        if ( self.location is None or errors.flat[k] > self.maximum ):
+            self.maximum = float(errors.flat[k])
+            self.location = tuple([ int(j) + o for j, o in zip(numpy.unravel_index(k, errors.shape), offset) ])
+        zeros = int(numpy.count_nonzero(errors == 0.0))
+        finite = errors[numpy.isfinite(errors) & ( errors > 0.0 )]
+        self.zeros += zeros
+        self.infinities += errors.size - finite.size - zeros
+        mantissa, exponent = numpy.frexp(finite)
+        index = ( exponent.astype(numpy.int64) - self.minExponent ) * self.bins + \
+            numpy.floor(( 2.0 * mantissa - 1.0 ) * self.bins).astype(numpy.int64)
+        self.histogram += numpy.bincount(index, minlength=self.histogram.size)
+
+    def getMean(self):
+        """ Mean of the errors. """
+        if ( self.count == 0 ):
+            return 0.0
+        return self.total / self.count
+
+    def getPercentile(self, q):
+        """ Nearest-rank percentile of the errors, rounded down to the lower edge of its histogram bin. """
+        import math
+        if ( self.count == 0 ):
+            return 0.0
+        rank = max(1, int(math.ceil(q / 100.0 * self.count)))
+        if ( rank <= self.zeros ):
+            return 0.0
+        cumulative = self.numpy.cumsum(self.histogram) + self.zeros
+        if ( rank > cumulative[-1] ):
+            return float("inf")
+        index = int(self.numpy.searchsorted(cumulative, rank))
+        exponent, step = divmod(index, self.bins)
+        return math.ldexp(0.5 + 0.5 * step / self.bins, exponent + self.minExponent)
+
+# Manifest of reference data digests, loaded on first use, and whether digests have been added to it since.
+referenceDigests = None
+referenceDigestsChanged = False
+# Git blob ids of the unmodified files below the DLBC root, by path relative to it, listed on first use.
+blobIds = None
+digestLock = threading.Lock()
+
+def importModules():
+    """ Import h5py and numpy, or return None if they are not installed. """
+    try:
+        import h5py
+        import numpy
+    except ImportError:
+        return None
+    return h5py, numpy
+
+def digestDataset(path, dataset="/OutArray"):
+    """ Compute the SHA-1 digest of the type, shape and contents of a dataset, a slab at a time.
+
+    Returns None if h5py or numpy are not installed, or the dataset is missing.
+    """
+    modules = importModules()
+    if ( not modules ):
+        return None
+    h5py, numpy = modules
+    with openFile(h5py, path) as f:
+        if ( dataset not in f ):
+            return None
+        d = f[dataset]
+        digest = hashlib.sha1("%s %s\n" % ( d.dtype.str, d.shape ))
+        for s in iterateSlabs(d.shape, 2 * d.dtype.itemsize, d.chunks):
+            digest.update(numpy.ascontiguousarray(d[s]).tobytes())
+    return digest.hexdigest()
+
+def loadReferenceDigests(dlbcRoot):
+    """ Load the manifest of reference data digests, or start an empty one. """
+    try:
+        with open(constructReferenceDigestsPath(dlbcRoot)) as f:
+            return json.load(f)
+    except ( IOError, ValueError ):
+        return {}
+
+def saveReferenceDigests(dlbcRoot):
+    """ Write the manifest of reference data digests atomically, if digests have been added to it during this run.
+
+    The blob ids are listed again by the next run, as the files may have changed in between.
+    """
+    global blobIds, referenceDigestsChanged
+    with digestLock:
+        blobIds = None
+        if ( not referenceDigestsChanged ):
+            return
+        manifestPath = constructReferenceDigestsPath(dlbcRoot)
+        temporaryPath = "%s.%d" % ( manifestPath, os.getpid() )
+        try:
+            with open(temporaryPath, "w") as f:
+                json.dump(referenceDigests, f, indent=2, sort_keys=True, separators=( ",", ": " ))
+                f.write("\n")
+            os.rename(temporaryPath, manifestPath)
+            referenceDigestsChanged = False
+        except ( IOError, OSError ) as e:
+            logDebug("Could not write the reference data digests '%s': %s." % ( manifestPath, e ))
+
+def loadBlobIds(dlbcRoot):
+    """ Get the git blob ids of the files below dlbcRoot which are unmodified in the working tree, by path relative to dlbcRoot. """
+    try:
+        staged = subprocess.check_output([ "git", "ls-files", "-s", "-z" ], cwd=dlbcRoot, stderr=subprocess.STDOUT)
+        modified = subprocess.check_output([ "git", "ls-files", "-m", "-z" ], cwd=dlbcRoot, stderr=subprocess.STDOUT)
+    except ( OSError, subprocess.CalledProcessError ):
+        return {}
+    ids = {}
+    for entry in staged.split("\0"):
+        if ( entry ):
+            info, path = entry.split("\t", 1)
+            ids[os.path.normpath(path)] = info.split()[1]
+    for path in modified.split("\0"):
+        ids.pop(os.path.normpath(path), None)
+    return ids
+
+def getBlobId(dlbcRoot, path):
+    """ Get the git blob id of a file: from the index if it is unmodified, otherwise by hashing it the way git does. """
+    global blobIds
+    with digestLock:
+        if ( blobIds is None ):
+            blobIds = loadBlobIds(dlbcRoot)
+        blobId = blobIds.get(os.path.relpath(os.path.realpath(path), os.path.realpath(dlbcRoot)))
+    if ( blobId ):
+        return blobId
+    digest = hashlib.sha1("blob %d\0" % os.path.getsize(path))
+    with open(path, "rb") as f:
+        for block in iter(lambda: f.read(1 << 20), b""):
+            digest.update(block)
+    return digest.hexdigest()
+
+def getReferenceDigest(dlbcRoot, path, dataset="/OutArray"):
+    """ Get the digest of a dataset of a reference file from the manifest, computing it if the contents of the file are new. """
+    global referenceDigests, referenceDigestsChanged
+    key = "%s:%s" % ( getBlobId(dlbcRoot, path), dataset )
+    with digestLock:
+        if ( referenceDigests is None ):
+            referenceDigests = loadReferenceDigests(dlbcRoot)
+        if ( key in referenceDigests ):
+            return referenceDigests[key]
+    digest = digestDataset(path, dataset)
+    if ( digest is None ):
+        return None
+    with digestLock:
+        # The manifest is written once at the end of the run, by saveReferenceDigests.
+        referenceDigests[key] = digest
+        referenceDigestsChanged = True
+    return digest
+
+def matchDigests(dlbcRoot, path1, path2, dataset="/OutArray"):
+    """ Check if a dataset of a file is bitwise identical to that of the reference file path2, by their digests.
+
+    Returns False if they differ or cannot be digested, in which case the files have to be compared in full.
+    """
+    try:
+        reference = getReferenceDigest(dlbcRoot, path2, dataset)
+        if ( reference is None ):
+            return False
+        return ( digestDataset(path1, dataset) == reference )
+    except ( IOError, OSError ):
+        # Let the full comparison report why the files cannot be read.
+        return False
+
+def computeErrors(numpy, metric, a, b, floor=None):
+    """ Compute the error of each value of a with respect to the reference b, as a float64 array.
+
+    The metric is "absolute" (|a - b|), "relative" (|a - b| / max(|b|, floor)) or "ulp" (the number of representable
+    values of the type of b between a and b). The floor defaults to the smallest normal float64, so a reference of zero
+    gives a large, but finite error. Equal values, including infinities, and NaN in both arrays have no error;
+    any other NaN is as far off as it gets.
+    """
+    with numpy.errstate(invalid="ignore", divide="ignore", over="ignore"):
+        if ( metric == "ulp" ):
+            ia = orderFloats(numpy, a)
+            ib = orderFloats(numpy, b)
+            # Subtract the unsigned integers exactly, before the count is converted to float64.
+            errors = numpy.where(ia >= ib, ia - ib, ib - ia).astype(numpy.float64)
+        else:
+            errors = numpy.abs(a.astype(numpy.float64) - b.astype(numpy.float64))
+            if ( metric == "relative" ):
+                errors /= numpy.maximum(numpy.abs(b.astype(numpy.float64)), floor or numpy.finfo(numpy.float64).tiny)
+    errors[numpy.isnan(errors) | numpy.isnan(a) | numpy.isnan(b)] = numpy.inf
+    errors[( a == b ) | ( numpy.isnan(a) & numpy.isnan(b) )] = 0.0
+    return errors
+
+def orderFloats(numpy, x):
+    """ Map floating point values to unsigned integers which are ordered the same, so their difference counts the ULPs between them. """
+    u = x.view(numpy.dtype("u%d" % x.dtype.itemsize)).astype(numpy.uint64)
+    sign = numpy.uint64(1 << ( 8 * x.dtype.itemsize - 1 ))
+    magnitude = u & ( sign - numpy.uint64(1) )
+    # Floats are stored as sign and magnitude: negative ones count down from the middle of the range, positive ones up,
+    # and both zeros are the middle.
+    return numpy.where(u & sign, sign - magnitude, sign + magnitude)
+
+def compareDatasets(path1, path2, metric="absolute", tolerance=None, relative=None, floor=None, dataset="/OutArray"):
+    """ Compare a dataset of two files element by element, where path2 holds the reference.
+
+    The errors are computed as described in computeErrors, relative errors below the given floor. A value is over tolerance if its error exceeds the tolerance,
+    for the absolute metric tolerance + relative * |reference|; without tolerances only identical values pass.
+    ULPs are counted in the type of the reference, other datasets than floating point ones are compared by absolute error.
+    Returns a dictionary with the metric, shape and size of the dataset, the largest error (maxError), the index where
+    it occurs (location), the mean error (meanError), its 95th percentile (p95Error), the number of values over
+    tolerance (overTolerance), and an error message if the datasets cannot be compared at all (error).
+    """
+    modules = importModules()
+    if ( not modules ):
+        logFatal("Comparisons of type '%s' require the h5py and numpy Python modules." % metric, -1)
+    h5py, numpy = modules
+
+    result = { "metric": metric, "shape": None, "size": 0, "maxError": 0.0, "location": None, "meanError": 0.0, "p95Error": 0.0,
+               "overTolerance": 0, "error": None }
+    limit = float(tolerance or 0.0)
+    rtol = float(relative or 0.0)
+    floor = float(floor or 0.0)
+    with openFile(h5py, path1) as f1:
+        with openFile(h5py, path2) as f2:
+            if ( dataset not in f1 or dataset not in f2 ):
+                result["error"] = "dataset '%s' is missing" % dataset
+                return result
+            d1 = f1[dataset]
+            d2 = f2[dataset]
+            if ( d1.shape != d2.shape ):
+                result["error"] = "the shapes %s and %s of dataset '%s' differ" % ( d1.shape, d2.shape, dataset )
+                return result
+            result["shape"] = d1.shape
+            result["size"] = d1.size
+
+            dtype = d2.dtype.newbyteorder("=")
+            if ( metric == "ulp" and dtype.kind != "f" ):
+                metric = "absolute"
+                result["metric"] = metric
+            if ( metric != "ulp" ):
+                dtype = numpy.dtype(numpy.float64)
+
+            statistics = ErrorStatistics(numpy)
+            valueBytes = d1.dtype.itemsize + d2.dtype.itemsize + 8 * slabArrays
+            for s in iterateSlabs(d1.shape, valueBytes, d2.chunks or d1.chunks):
+                a = numpy.asarray(d1[s], dtype=dtype)
+                b = numpy.asarray(d2[s], dtype=dtype)
+                errors = computeErrors(numpy, metric, a, b, floor)
+                if ( metric == "absolute" ):
+                    result["overTolerance"] += int(numpy.count_nonzero(errors > limit + rtol * numpy.abs(b)))
+                else:
+                    result["overTolerance"] += int(numpy.count_nonzero(errors > limit))
+                statistics.add(errors, [ j.start for j in s ])
+            result["maxError"] = statistics.maximum
+            result["location"] = statistics.location
+            result["meanError"] = statistics.getMean()
+            result["p95Error"] = statistics.getPercentile(95)
+    return result
+
+def formatTolerance(metric, tolerance=None, relative=None, floor=None):
+    """ Describe the tolerance of a comparison. """
+    if ( metric == "absolute" ):
+        return "absolute tolerance %s, relative tolerance %s" % ( tolerance or 0, relative or 0 )
+    if ( metric == "relative" and floor ):
+        return "relative tolerance %s, floor %s" % ( tolerance or 0, floor )
+    return "%s tolerance %s" % ( metric, tolerance or 0 )
+
+def formatComparison(result, tolerance=None, relative=None, floor=None):
+    """ Describe the result of compareDatasets in a sentence. """
+    if ( result["error"] ):
+        return "Cannot compare: %s." % result["error"]
+    return "%d of %d values are over tolerance (%s); %s error: max %e at %s, mean %e, 95th percentile %e." % \
+        ( result["overTolerance"], result["size"], formatTolerance(result["metric"], tolerance, relative, floor), result["metric"],
+          result["maxError"], list(result["location"] or []), result["meanError"], result["p95Error"] )
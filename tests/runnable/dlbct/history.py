@@ -0,0 +1,42 @@
+#!/usr/bin/env python
+
+"""
+Use the run times of subtests in previous invocations to order the work.
+"""
+
+from logging import *
+from results import encodeParameters, queryResults
+
+def loadTimings(options):
+    """ Load the most recent run time of each parameter set for the current compiler, build type and fast mode. """
+    rows = queryResults(options, "SELECT test, parameters, wall_time FROM results WHERE compiler = ? AND build = ? AND fast = ? AND wall_time > 0 ORDER BY id", ( options.dub_compiler, options.dub_build, int(options.fast) ))
+    if ( not rows ):
+        logDebug("No previous run times found, test order will not be optimized.")
+    timings = {}
+    for r in rows:
+        timings[( r[0], r[1] )] = r[2]
+    return timings
+
+def estimateSubtest(timings, thisTest, m = None):
+    """ Return the previous run time of a parameter set, or None if it is unknown. """
+    return timings.get(( thisTest.name, encodeParameters(m) ))
+
+def estimateTest(timings, thisTest):
+    """ Return the previous run time of all parameter sets of a test, or None if any of them is unknown. """
+    from run import mapParameterMatrix
+    if ( thisTest.parameters ):
+        estimates = [ estimateSubtest(timings, thisTest, m) for m in mapParameterMatrix(thisTest) ]
+    else:
+        estimates = [ estimateSubtest(timings, thisTest) ]
+    if ( None in estimates ):
+        return None
+    return sum(estimates)
+
+def longestFirst(items, estimate):
+    """ Sort items by decreasing estimated run time (LPT). Items without an estimate come first, as they may be the longest of all. """
+    def key(item):
+        e = estimate(item)
+        if ( e is None ):
+            return ( 0, 0.0 )
+        return ( 1, -e )
+    return sorted(items, key=key)
@@ -0,0 +1,79 @@
+#!/usr/bin/env python
+
+"""
+Content hashes of everything a subtest depends on, to skip subtests which passed and have not changed since.
+"""
+
+import glob
+import hashlib
+import json
+import os
+
+from logging import *
+from path import *
+from results import encodeParameters, hashFile
+
+def getCompare(options, thisTest):
+    """ Get the compare parameter which applies to the current mode. """
+    if ( options.fast and thisTest.fast ):
+        return thisTest.fast["compare"]
+    return thisTest.compare
+
+def getReferenceFiles(options, thisTest, m = None):
+    """ Get the reference data files named by the comparisons of a parameter set. """
+    from compare import replaceTokensInCompare
+    from run import getSubtestNP
+    compare = getCompare(options, thisTest)
+    if ( m ):
+        compare = replaceTokensInCompare(compare, m, getSubtestNP(thisTest, m))
+    files = []
+    for c in compare.get("comparison", []):
+        for d in compare.get("data", []):
+            search = os.path.join(thisTest.testRoot, "reference-data", c["files"].replace("%data%", d))
+            files += glob.glob(search)
+    return sorted(set(files))
+
+def getShellScripts(options, thisTest):
+    """ Get the scripts run by the compare:shell parameter. """
+    return [ os.path.join(thisTest.testRoot, s.split(" ")[0]) for s in getCompare(options, thisTest).get("shell", []) ]
+
+def hashSubtest(options, thisTest, m = None):
+    """ Hash the test JSON, input file, reference data, compare scripts, comparison mode, executable and command line of a parameter set. """
+    from run import prepareSubtestCommand
+    exePath = constructExeTargetPath(thisTest.configuration, options.dub_build, options.dub_compiler, options.dlbc_root)
+    exeHash = hashFile(exePath)
+    # The executable is represented by its hash rather than its path.
+    command = [ exeHash if c == exePath else c for c in prepareSubtestCommand(options, thisTest, m) ]
+
+    h = hashlib.sha1()
+    def update(label, value):
+        h.update(( "%s:%s\n" % ( label, value ) ).encode("utf-8"))
+
+    update("json", hashFile(thisTest.filePath))
+    update("input", hashFile(os.path.join(thisTest.testRoot, thisTest.inputFile)))
+    for f in getReferenceFiles(options, thisTest, m):
+        update("reference " + os.path.relpath(f, thisTest.testRoot), hashFile(f))
+    for f in getShellScripts(options, thisTest):
+        update("shell " + os.path.relpath(f, thisTest.testRoot), hashFile(f))
+    # Whether the comparisons run and whether their accuracy applies depend on these options; a parameter set compared in another mode runs again.
+    update("compare", json.dumps([ options.compare_none, options.compare_strict, options.compare_lax ]))
+    update("exe", exeHash)
+    update("command", json.dumps(command))
+    return h.hexdigest()
+
+def isUnchanged(options, thisTest, m = None):
+    """ Check if a parameter set passed the last time it was run, and nothing it depends on has changed since. """
+    result = options.lastResults.get(( thisTest.name, encodeParameters(m) ))
+    if ( result is None ):
+        return False
+    returncode, compareErrors, inputHash = result
+    if ( returncode != 0 or compareErrors > 0 or inputHash is None ):
+        return False
+    return ( inputHash == hashSubtest(options, thisTest, m) )
+
+def isUnchangedTest(options, thisTest):
+    """ Check if all parameter sets of a test can be skipped in incremental mode. """
+    from run import mapParameterMatrix
+    if ( thisTest.parameters ):
+        return all([ isUnchanged(options, thisTest, m) for m in mapParameterMatrix(thisTest) ])
+    return isUnchanged(options, thisTest)
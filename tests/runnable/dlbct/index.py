@@ -0,0 +1,164 @@
+#!/usr/bin/env python
+
+"""
+Find the tests through a cached index, so that startup, --describe and --latex do not have to parse every JSON file.
+
+The index stores the listing of each directory below the search root, keyed by the modification time of the directory,
+and the metadata of each test, keyed by the modification time and size of its JSON file. Only directories and tests
+which have changed since the last invocation are read again.
+"""
+
+import fnmatch
+import json
+import os
+
+from logging import *
+from path import *
+from selection import parseSelection
+from test import IndexedTest, Test
+
+# Increment when the entries change, so older indices are discarded.
+indexVersion = 1
+
+def loadIndex(dlbcRoot):
+    """ Load the index, or start an empty one if it does not exist or is outdated. """
+    empty = { "version": indexVersion, "directories": {}, "tests": {} }
+    try:
+        with open(constructIndexPath(dlbcRoot)) as f:
+            index = json.load(f)
+    except ( IOError, ValueError ):
+        return empty
+    if ( index.get("version") != indexVersion ):
+        return empty
+    return index
+
+def saveIndex(dlbcRoot, index):
+    """ Write the index atomically, so concurrent invocations never read a partial file. """
+    indexPath = constructIndexPath(dlbcRoot)
+    temporaryPath = "%s.%d" % ( indexPath, os.getpid() )
+    try:
+        with open(temporaryPath, "w") as f:
+            json.dump(index, f, sort_keys=True)
+        os.rename(temporaryPath, indexPath)
+    except ( IOError, OSError ) as e:
+        logDebug("Could not write the test index '%s': %s." % ( indexPath, e ))
+
+def getStamp(path):
+    """ Get the modification time and size of a path. """
+    stat = os.stat(path)
+    return [ stat.st_mtime, stat.st_size ]
+
+def listDirectory(index, directory):
+    """ Get the JSON files and subdirectories of a directory, from the index if the directory has not changed.
+
+    Symbolic links are ignored: scratch directories link to the files of their test, which must not be found twice.
+    """
+    stamp = getStamp(directory)
+    cached = index["directories"].get(directory)
+    if ( cached and cached["stamp"] == stamp ):
+        return cached["files"], cached["directories"], False
+    files = []
+    directories = []
+    for name in sorted(os.listdir(directory)):
+        path = os.path.join(directory, name)
+        if ( os.path.islink(path) ):
+            continue
+        if ( os.path.isdir(path) ):
+            directories.append(name)
+        elif ( fnmatch.fnmatch(name, '*.json*') ):
+            files.append(name)
+    index["directories"][directory] = { "stamp": stamp, "files": files, "directories": directories }
+    return files, directories, True
+
+def describeTest(thisTest):
+    """ Extract the metadata of a test which is stored in the index. """
+    return {
+        "name": thisTest.name,
+        "description": thisTest.description,
+        "configuration": thisTest.configuration,
+        "tags": thisTest.tags,
+        "latex": thisTest.latex,
+        "np": thisTest.np,
+        "nSubtests": thisTest.nSubtests,
+        "disabled": thisTest.disabled,
+    }
+
+def indexTest(index, testRoot, fileName):
+    """ Get the indexed test for a JSON file, parsing it only if it has changed. """
+    filePath = os.path.join(testRoot, fileName)
+    stamp = getStamp(filePath)
+    cached = index["tests"].get(filePath)
+    if ( cached and cached["stamp"] == stamp ):
+        return IndexedTest(testRoot, fileName, cached["test"]), False
+    logDebug("Indexing test '%s' ..." % os.path.relpath(filePath))
+    entry = describeTest(Test(testRoot, fileName))
+    index["tests"][filePath] = { "stamp": stamp, "test": entry }
+    return IndexedTest(testRoot, fileName, entry), True
+
+def findTests(options, searchRoot):
+    """ Find the tests below searchRoot, or the single test searchRoot points to, using the index.
+
+    Returns IndexedTest objects sorted by path, and whether a single test was requested.
+    """
+    searchRoot = os.path.normpath(searchRoot)
+    index = loadIndex(options.dlbc_root)
+    tests = []
+    changed = False
+    if ( os.path.isfile(searchRoot) ):
+        test, changed = indexTest(index, os.path.dirname(searchRoot), os.path.basename(searchRoot))
+        if ( changed ):
+            saveIndex(options.dlbc_root, index)
+        return [ test ], True
+
+    found = set()
+    visited = set()
+    pending = [ searchRoot ]
+    while ( pending ):
+        directory = pending.pop()
+        visited.add(directory)
+        files, directories, listed = listDirectory(index, directory)
+        changed = changed or listed
+        for fileName in files:
+            test, indexed = indexTest(index, directory, fileName)
+            changed = changed or indexed
+            found.add(test.filePath)
+            tests.append(test)
+        pending += [ os.path.join(directory, d) for d in directories ]
+
+    # Forget the directories and tests below searchRoot which have been removed.
+    for key, seen in [ ( "directories", visited ), ( "tests", found ) ]:
+        for path in list(index[key]):
+            if ( path not in seen and path.startswith(searchRoot + os.sep) ):
+                del index[key][path]
+                changed = True
+    if ( changed ):
+        saveIndex(options.dlbc_root, index)
+    return sorted(tests, key=lambda test: test.filePath), False
+
+def selectTests(options, tests, load=True):
+    """ Select the tests to process, and parse their JSON files if load is set.
+
+    Returns all tests, with the selected ones replaced by their parsed version if loaded, and the selected tests.
+    The other tests are marked as skipped, so they still show up in the report.
+    """
+    selection = None
+    if ( options.select ):
+        selection = parseSelection(options.select)
+    allTests = []
+    selected = []
+    for test in tests:
+        if ( options.only_tag and ( not options.only_tag in test.tags ) ):
+            test.skipped = [ True ] * test.nSubtests
+            logDebug("Test '%s' does not have the required tag '%s', skipping ..." % ( test.name, options.only_tag ) )
+            allTests.append(test)
+            continue
+        if ( selection and not selection(test) ):
+            test.skipped = [ True ] * test.nSubtests
+            logDebug("Test '%s' does not match the selection '%s', skipping ..." % ( test.name, options.select ) )
+            allTests.append(test)
+            continue
+        if ( load ):
+            test = test.load()
+        allTests.append(test)
+        selected.append(test)
+    return allTests, selected
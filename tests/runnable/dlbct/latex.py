@@ -4,10 +4,9 @@
 Generate LaTeX output from selected tests.
 """
 
+from index import findTests
 from logging import *
-from test import Test
 
-import fnmatch
 import os
 
 def replaceTokensInLaTeX(latex, testRoot):
@@ -33,13 +32,9 @@ def generateLaTeXforTest(thisTest, searchRoot):
     else:
         print("\\todo{Long description}")
 
-def generateLaTeX(searchRoot):
+def generateLaTeX(options, searchRoot):
     """ Generate LaTeX for all tests below searchRoot. """
-    matchingTests = []
-    for testRoot, dirnames, filenames in os.walk(searchRoot):
-        for filename in fnmatch.filter(filenames, '*.json*'):
-            matchingTests.append(Test(testRoot, filename))
-
-    for test in sorted(matchingTests, key=lambda test: test.filePath):
+    matchingTests, singleTest = findTests(options, searchRoot)
+    for test in matchingTests:
         generateLaTeXforTest(test, searchRoot)
 
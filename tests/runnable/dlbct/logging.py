@@ -6,6 +6,8 @@ Helper functions for logging with particular verbosity levels.
 The levels match the ones in DLBC.
 """
 
+import threading
+
 verbosityChoices = ["Debug", "Information", "Notification", "Warning", "Error", "Fatal", "Off"]
 
 def getVerbosityLevel(str):
@@ -51,7 +53,8 @@ def getVerbosityPrefix(usePrefix, logLevel):
 def logAtLevel(str, logLevel, returncode=0):
     """ Log a message at logLevel. """
     if ( verbosityLevel >= logLevel ):
-        print(getTimePrefix(logTime) + getVerbosityPrefix(logPrefix, logLevel) + str)
+        with logLock:
+            print(getTimePrefix(logTime) + getVerbosityPrefix(logPrefix, logLevel) + str)
     if ( logLevel == 2 ):
         return 1
     if ( logLevel < 2 ):
@@ -60,7 +63,8 @@ def logAtLevel(str, logLevel, returncode=0):
 def logPlainAtLevel(str, logLevel, returncode=0):
     """ Log a message at logLevel, assuming logTime and logPrefix are False. """
     if ( verbosityLevel >= logLevel ):
-        print(str)
+        with logLock:
+            print(str)
     if ( logLevel == 2 ):
         return 1
     if ( logLevel < 2 ):
@@ -93,4 +97,6 @@ def logFatal(str, returncode):
 verbosityLevel = getVerbosityLevel("Debug")
 logPrefix = False
 logTime = False
+# Tests may be run from multiple threads; keep lines from interleaving.
+logLock = threading.Lock()
 
@@ -0,0 +1,47 @@
+#!/usr/bin/env python
+
+"""
+Run one rank of a program in an MPMD launch, and record its return code, run time and resource usage.
+
+The record is written to mpmd-status-<pid>.json in the working directory, so the test suite can attribute
+the results to the parameter set the program belongs to. The return code of the program is passed on.
+"""
+
+import errno
+import json
+import os
+import subprocess
+import sys
+import time
+
+def main():
+    t0 = time.time()
+    p = subprocess.Popen(sys.argv[1:])
+    while ( True ):
+        try:
+            pid, status, rusage = os.wait4(p.pid, 0)
+            break
+        except OSError as e:
+            if ( e.errno != errno.EINTR ):
+                raise
+    if ( os.WIFSIGNALED(status) ):
+        returncode = -os.WTERMSIG(status)
+    else:
+        returncode = os.WEXITSTATUS(status)
+    record = {
+        "returncode": returncode,
+        "time": time.time() - t0,
+        "utime": rusage.ru_utime,
+        "stime": rusage.ru_stime,
+        "maxrss": rusage.ru_maxrss * 1024, # Linux reports kilobytes
+        "readBytes": rusage.ru_inblock * 512, # Linux counts blocks of 512 bytes
+        "writeBytes": rusage.ru_oublock * 512,
+    }
+    with open("mpmd-status-%d.json" % os.getpid(), "w") as f:
+        json.dump(record, f)
+    if ( returncode < 0 ):
+        returncode = 128 - returncode
+    sys.exit(returncode)
+
+if __name__ == '__main__':
+    main()
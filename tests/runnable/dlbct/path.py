@@ -14,9 +14,73 @@ def constructExeTargetName(configuration, build, compiler):
     """ Construct file name for executable. """
     return "dlbc-" + configuration + "-" + build + "-" + compiler
 
+def constructBuildRoot(dlbcRoot):
+    """ Construct the location of the working directories of dub builds. """
+    import os
+    return os.path.normpath(os.path.join(dlbcRoot, "tests/build"))
+
+def constructBuildPath(configuration, build, compiler, dlbcRoot):
+    """ Construct the working directory of the dub build of an executable. """
+    import os
+    return os.path.join(constructBuildRoot(dlbcRoot), constructExeTargetName(configuration, build, compiler))
+
+def constructExeCacheRoot(dlbcRoot):
+    """ Construct the location of the cache of executables. """
+    import os
+    return os.path.normpath(os.path.join(dlbcRoot, "tests/exe-cache"))
+
+def constructExeCachePath(configuration, build, compiler, key, dlbcRoot):
+    """ Construct the path of a cached executable, built from the sources and compiler identified by key. """
+    import os
+    return os.path.join(constructExeCacheRoot(dlbcRoot), constructExeTargetName(configuration, build, compiler) + "-" + key)
+
 def constructCoveragePath(dlbcRoot):
     """ Construct the location where coverage data will be stored. """
     import os
     return os.path.normpath(os.path.join(dlbcRoot, "tests/coverage"))
 
+def constructUnittestCoveragePath(dlbcRoot, configuration):
+    """ Construct the directory the unittests of a configuration are run in, which keeps their coverage data apart. """
+    import os
+    return os.path.join(constructCoveragePath(dlbcRoot), "unittest-" + configuration)
+
+def constructResultsPath(dlbcRoot):
+    """ Construct the location of the database of test results. """
+    import os
+    return os.path.normpath(os.path.join(dlbcRoot, "tests/results.db"))
+
+def constructIndexPath(dlbcRoot):
+    """ Construct the location of the cached index of the tests. """
+    import os
+    return os.path.normpath(os.path.join(dlbcRoot, "tests/test-index.json"))
 
+def constructReferenceDigestsPath(dlbcRoot):
+    """ Construct the location of the manifest of reference data digests. """
+    import os
+    return os.path.normpath(os.path.join(dlbcRoot, "tests/reference-digests.json"))
+
+def constructShardTimingsPath(dlbcRoot):
+    """ Construct the location of the shared run times which the shards are balanced by. """
+    import os
+    return os.path.normpath(os.path.join(dlbcRoot, "tests/shard-timings.json"))
+
+def constructScratchRoot(testRoot):
+    """ Construct the location of the scratch directories of a test. """
+    import os
+    return os.path.join(testRoot, "scratch")
+
+def constructScratchPath(testRoot, name, i):
+    """ Construct the scratch directory to run parameter set i of a test in. Tests in the same directory have scratch directories of their own. """
+    import os
+    return os.path.join(constructScratchRoot(testRoot), "%s-parameter-set-%02d" % ( name, i + 1 ))
+
+
+def constructBatchRoot(dlbcRoot):
+    """ Construct the location where the programs of MPMD batches are run. """
+    import os
+    return os.path.normpath(os.path.join(dlbcRoot, "tests/batch"))
+
+def constructBatchPath(dlbcRoot, name, i):
+    """ Construct the directory to run parameter set i of a test in as part of an MPMD batch. """
+    import os
+    return os.path.join(constructBatchRoot(dlbcRoot), "%s-parameter-set-%02d" % ( name, i + 1 ))
@@ -0,0 +1,216 @@
+#!/usr/bin/env python
+
+"""
+Persistent database of subtest results.
+
+Every executed subtest adds one row, which makes the history of the test suite queryable, e.g.:
+
+  sqlite3 tests/results.db "SELECT timestamp, test, wall_time FROM results WHERE returncode != 0"
+
+The error statistics of the in-process comparisons of each subtest are kept in the comparisons table, e.g.:
+
+  sqlite3 tests/results.db "SELECT r.test, c.file, c.max_error, c.p95_error FROM comparisons c JOIN results r ON r.id = c.result_id"
+"""
+
+import json
+import os
+import sqlite3
+import threading
+
+from logging import *
+from path import *
+
+# Subtests running in different threads record their results concurrently.
+resultsLock = threading.Lock()
+
+# Hashes of files, keyed by path, modification time and size.
+fileHashes = {}
+
+resultsSchema = """
+CREATE TABLE IF NOT EXISTS results (
+  id INTEGER PRIMARY KEY AUTOINCREMENT,
+  test TEXT NOT NULL,
+  parameters TEXT NOT NULL,
+  compiler TEXT NOT NULL,
+  build TEXT NOT NULL,
+  fast INTEGER NOT NULL,
+  exe_hash TEXT,
+  wall_time REAL,
+  returncode INTEGER,
+  compare_errors INTEGER,
+  timestamp TEXT NOT NULL
+)
+"""
+
+# Source lines covered by each parameter set in its last successful coverage run, as a JSON list per source file.
+coverageSchema = """
+CREATE TABLE IF NOT EXISTS coverage (
+  test TEXT NOT NULL,
+  parameters TEXT NOT NULL,
+  file TEXT NOT NULL,
+  lines TEXT NOT NULL,
+  executable TEXT,
+  revision TEXT,
+  timestamp TEXT NOT NULL,
+  PRIMARY KEY (test, parameters, file)
+)
+"""
+
+# Time of each dub build, with the hash of the sources it was built from and the number of builds running at the same time.
+buildsSchema = """
+CREATE TABLE IF NOT EXISTS builds (
+  id INTEGER PRIMARY KEY AUTOINCREMENT,
+  compiler TEXT NOT NULL,
+  build TEXT NOT NULL,
+  configuration TEXT NOT NULL,
+  source_hash TEXT NOT NULL,
+  revision TEXT,
+  build_time REAL NOT NULL,
+  timestamp TEXT NOT NULL,
+  concurrency INTEGER
+)
+"""
+
+# Error statistics of the in-process comparisons of a subtest, referring to its row in results.
+comparisonsSchema = """
+CREATE TABLE IF NOT EXISTS comparisons (
+  result_id INTEGER NOT NULL,
+  file TEXT NOT NULL,
+  type TEXT NOT NULL,
+  tolerance TEXT,
+  size INTEGER,
+  over_tolerance INTEGER,
+  max_error REAL,
+  mean_error REAL,
+  p95_error REAL,
+  location TEXT
+)
+"""
+
+# Columns added after the first version of the schema, which are added to existing databases.
+buildsColumns = [ ( "concurrency", "INTEGER" ) ]
+coverageColumns = [ ( "executable", "TEXT" ) ]
+resultsColumns = [ ( "input_hash", "TEXT" ), ( "user_time", "REAL" ), ( "sys_time", "REAL" ), ( "max_rss", "INTEGER" ),
+                   ( "read_bytes", "INTEGER" ), ( "write_bytes", "INTEGER" ), ( "timed_out", "INTEGER" ) ]
+
+def connectResults(dlbcRoot):
+    """ Open the results database, creating it if necessary. """
+    connection = sqlite3.connect(constructResultsPath(dlbcRoot), timeout=60.0)
+    connection.execute(resultsSchema)
+    connection.execute(coverageSchema)
+    connection.execute(buildsSchema)
+    connection.execute(comparisonsSchema)
+    for table, columns in [ ( "results", resultsColumns ), ( "coverage", coverageColumns ), ( "builds", buildsColumns ) ]:
+        existing = [ c[1] for c in connection.execute("PRAGMA table_info(%s)" % table).fetchall() ]
+        for name, ctype in columns:
+            if ( name not in existing ):
+                connection.execute("ALTER TABLE %s ADD COLUMN %s %s" % ( table, name, ctype ))
+    connection.execute("CREATE INDEX IF NOT EXISTS results_subtest ON results (test, compiler, build, fast)")
+    return connection
+
+def encodeParameters(m):
+    """ Encode a parameter set from mapParameterMatrix in a form that can be stored and compared. """
+    if ( not m ):
+        return "[]"
+    return json.dumps([ list(p) for p in m ])
+
+def hashFile(path):
+    """ Calculate the SHA-1 hash of a file, or return None if it does not exist. """
+    import hashlib
+    if ( not os.path.isfile(path) ):
+        return None
+    stat = os.stat(path)
+    key = ( path, stat.st_mtime, stat.st_size )
+    if ( key in fileHashes ):
+        return fileHashes[key]
+    h = hashlib.sha1()
+    with open(path, 'rb') as f:
+        for chunk in iter(lambda: f.read(1 << 20), b""):
+            h.update(chunk)
+    fileHashes[key] = h.hexdigest()
+    return fileHashes[key]
+
+def recordSubtest(options, thisTest, i, m = None):
+    """ Add the result of a single parameter set of a test to the results database. """
+    import time
+    from incremental import hashSubtest
+    exePath = constructExeTargetPath(thisTest.configuration, options.dub_build, options.dub_compiler, options.dlbc_root)
+    returncode = thisTest.returncodes[i]
+    # A non-zero return code is counted as one error, everything else stems from the comparisons.
+    compareErrors = thisTest.errors[i]
+    if ( returncode != 0 ):
+        compareErrors -= 1
+    resources = thisTest.resources[i]
+    comparisons = [ ( c["file"], c["type"], c["tolerance"], c["size"], c["overTolerance"], c["maxError"], c["meanError"], c["p95Error"],
+                      json.dumps(c["location"]) if c["location"] is not None else None ) for c in thisTest.comparisons[i] ]
+    row = ( thisTest.name, encodeParameters(m), options.dub_compiler, options.dub_build, int(options.fast), hashFile(exePath),
+            thisTest.timers[i], returncode, compareErrors, time.strftime("%Y-%m-%dT%H:%M:%SZ", time.gmtime()), hashSubtest(options, thisTest, m),
+            resources["utime"], resources["stime"], resources["maxrss"], resources["readBytes"], resources["writeBytes"], int(resources["timedOut"]) )
+    with resultsLock:
+        connection = connectResults(options.dlbc_root)
+        try:
+            with connection:
+                cursor = connection.execute("INSERT INTO results (test, parameters, compiler, build, fast, exe_hash, wall_time, returncode, compare_errors, timestamp, input_hash, "
+                                            "user_time, sys_time, max_rss, read_bytes, write_bytes, timed_out) VALUES (?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?)", row)
+                connection.executemany("INSERT INTO comparisons (result_id, file, type, tolerance, size, over_tolerance, max_error, mean_error, p95_error, location) "
+                                       "VALUES (?, ?, ?, ?, ?, ?, ?, ?, ?, ?)", [ ( cursor.lastrowid, ) + c for c in comparisons ])
+        finally:
+            connection.close()
+
+def recordBuild(dlbcRoot, compiler, build, configuration, sourceHash, revision, buildTime, concurrency):
+    """ Add the time of a dub build to the results database. """
+    import time
+    row = ( compiler, build, configuration, sourceHash, revision, buildTime, time.strftime("%Y-%m-%dT%H:%M:%SZ", time.gmtime()), concurrency )
+    with resultsLock:
+        connection = connectResults(dlbcRoot)
+        try:
+            with connection:
+                connection.execute("INSERT INTO builds (compiler, build, configuration, source_hash, revision, build_time, timestamp, concurrency) VALUES (?, ?, ?, ?, ?, ?, ?, ?)",
+                                   row)
+        finally:
+            connection.close()
+
+def loadBuildTimes(dlbcRoot, compiler, build, configuration, concurrency, n):
+    """ Get the times of the last n builds of an executable which ran with the given concurrency, oldest first. """
+    with resultsLock:
+        connection = connectResults(dlbcRoot)
+        try:
+            # Builds recorded before the concurrency was stored ran one at a time.
+            rows = connection.execute("SELECT build_time FROM builds WHERE compiler = ? AND build = ? AND configuration = ? AND COALESCE(concurrency, 1) = ? "
+                                      "ORDER BY id DESC LIMIT ?", ( compiler, build, configuration, concurrency, n )).fetchall()
+        finally:
+            connection.close()
+    return [ r[0] for r in reversed(rows) ]
+
+def queryResults(options, query, arguments):
+    """ Run a query on the results database, returns an empty list if there is no database yet. """
+    if ( not os.path.isfile(constructResultsPath(options.dlbc_root)) ):
+        return []
+    with resultsLock:
+        connection = connectResults(options.dlbc_root)
+        try:
+            return connection.execute(query, arguments).fetchall()
+        finally:
+            connection.close()
+
+def loadLastResults(options):
+    """ Get the most recent (returncode, compare_errors, input_hash) for each (test, parameters) run with the current compiler, build type and fast mode. """
+    rows = queryResults(options, "SELECT test, parameters, returncode, compare_errors, input_hash FROM results WHERE compiler = ? AND build = ? AND fast = ? ORDER BY id", ( options.dub_compiler, options.dub_build, int(options.fast) ))
+    lastResults = {}
+    for r in rows:
+        lastResults[( r[0], r[1] )] = ( r[2], r[3], r[4] )
+    return lastResults
+
+def hasFailed(lastResults, thisTest, m = None):
+    """ Check if a parameter set failed the last time it was run. Never-run parameter sets have not failed. """
+    result = lastResults.get(( thisTest.name, encodeParameters(m) ))
+    if ( result is None ):
+        return False
+    return ( result[0] != 0 or result[1] > 0 )
+
+def hasFailedTest(lastResults, thisTest):
+    """ Check if any parameter set of a test failed the last time it was run. """
+    from run import mapParameterMatrix
+    if ( thisTest.parameters ):
+        return any([ hasFailed(lastResults, thisTest, m) for m in mapParameterMatrix(thisTest) ])
+    return hasFailed(lastResults, thisTest)
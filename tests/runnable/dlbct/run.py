@@ -5,102 +5,390 @@ Wrappers to run tests and compare the results to their reference datasets.
 """
 
 import os
+import re
+import shutil
 import subprocess
+import sys
+import threading
 
+from affected import isAffected, recordCoverage
 from compare import *
+from history import *
+from incremental import isUnchanged
 from logging import *
 from path import *
 from plot import *
+from results import hasFailed, recordSubtest
 from timers import *
 
+# Isolated parameter sets of the same test move their output into the same directory.
+runRootLock = threading.Lock()
+
+# DLBC prefixes fatal log messages with this marker, possibly after a time stamp.
+fatalMarker = re.compile(r"\[F\] ")
+
+# Process groups of the running subtests, with the events that are set when they are aborted.
+runningGroups = {}
+# Number of failed parameter sets, which stops the test suite when it reaches --max-failures.
+failureLock = threading.Lock()
+failureCount = 0
+failureLimitReached = threading.Event()
+
 def runTest(options, thisTest):
-    from coverage import mergeCovLsts
-    """ Run all parameter sets for a single test. Returns number of errors encountered. """
+    """ Run all parameter sets for a single test. """
     logNotification("Running subtests ...")
+    for i, m in orderParameterSets(options, thisTest):
+        runParameterSet(options, thisTest, i, m)
 
-    np = thisTest.np
-
+def orderParameterSets(options, thisTest):
+    """ List the (index, parameter set) pairs of a test, longest first. A test without parameters has a single set None. """
     if ( thisTest.parameters ):
-        map = mapParameterMatrix(thisTest)
-        for i, m in enumerate(map):
-            # Get the parallel.nc parameter from the parameter set, if it's included
-            # If it is, set np to the product of its values
-            nc = getNC(m)
-            if ( nc ):
-                np = reduce(lambda x, y: int(x) * int(y), nc[1:-1].split(","), 1)
-
-            if ( options.only_first ):
-                if ( i == 0 ):
-                    logInformation("  Running parameter set %d of %d (only this one will be executed) ..." % (i+1, thisTest.nSubtests))
-                else:
-                    logInformation("  Skipping parameter set %d of %d ..." % (i+1, thisTest.nSubtests))
-                    thisTest.skipped[i] = True
-                    continue
-            elif ( options.only_serial and np > 1):
-                thisTest.skipped[i] = True
-                logInformation("  Parameter set %d of %d has np > 1, skipping ..." % (i+1, thisTest.nSubtests))
-                continue
-            else:
-                logInformation("  Running parameter set %d of %d ..." % (i+1, thisTest.nSubtests))
+        # Start the parameter sets that took longest before, so they do not end up holding up the rest.
+        return longestFirst(enumerate(mapParameterMatrix(thisTest)), lambda im: estimateSubtest(options.timings, thisTest, im[1]))
+    return [ ( 0, None ) ]
+
+def skipParameterSet(options, thisTest, i, m, np):
+    """ Check if a parameter set should be skipped, and mark it as such. """
+    if ( failureLimitReached.is_set() ):
+        logInformation("  Parameter set %d of %d is not run, the failure limit has been reached ..." % (i+1, thisTest.nSubtests))
+    elif ( options.shardUnits is not None and ( thisTest.name, i ) not in options.shardUnits ):
+        logInformation("  Parameter set %d of %d belongs to another shard, skipping ..." % (i+1, thisTest.nSubtests))
+    elif ( options.only_first and thisTest.parameters ):
+        if ( i == 0 ):
+            logInformation("  Running parameter set %d of %d (only this one will be executed) ..." % (i+1, thisTest.nSubtests))
+            return False
+        logInformation("  Skipping parameter set %d of %d ..." % (i+1, thisTest.nSubtests))
+    elif ( options.only_serial and np > 1):
+        logInformation("  Parameter set %d of %d has np > 1, skipping ..." % (i+1, thisTest.nSubtests))
+    elif ( options.affected_by and not isAffected(options, thisTest, m) ):
+        logInformation("  Parameter set %d of %d is not affected by the changes, skipping ..." % (i+1, thisTest.nSubtests))
+    elif ( options.rerun_failed and not hasFailed(options.lastResults, thisTest, m) ):
+        logInformation("  Parameter set %d of %d did not fail last time, skipping ..." % (i+1, thisTest.nSubtests))
+    elif ( options.incremental and isUnchanged(options, thisTest, m) ):
+        logInformation("  Parameter set %d of %d passed last time and is unchanged, skipping ..." % (i+1, thisTest.nSubtests))
+    else:
+        logInformation("  Running parameter set %d of %d ..." % (i+1, thisTest.nSubtests))
+        return False
+    thisTest.skipped[i] = True
+    return True
 
-            # Prepare command
-            command = prepareSubtestCommand(options, thisTest, m)
+def runParameterSet(options, thisTest, i, m):
+    """ Run, compare and record a single parameter set of a test. """
+    if ( executeParameterSet(options, thisTest, i, m) ):
+        postprocessParameterSet(options, thisTest, i, m)
 
-            # Run subtest
-            runSubtest(command, thisTest, i)
+def executeParameterSet(options, thisTest, i, m):
+    """ Run DLBC for a single parameter set of a test. Returns False if the parameter set has been skipped, or failed to run and has been recorded already. """
 
-            # Postprocessing
-            if ( options.timers or options.timers_all ):
-                moveTimersData(thisTest.testRoot, options.dub_compiler)
+    # Get the parallel.nc parameter from the parameter set, if it's included
+    # If it is, set np to the product of its values
+    np = getSubtestNP(thisTest, m)
 
-            if ( not options.coverage ):
-                if ( not options.compare_none ):
-                    compareTest(options, thisTest, i, m, np)
-            else:
-                if ( thisTest.errors[i] == 0 ):
-                    covpath = constructCoveragePath(options.dlbc_root)
-                    mergeCovLsts(options, thisTest.testRoot, covpath)
-                else:
-                    logNotification("No succesful tests, not merging coverage information ...")
+    if ( skipParameterSet(options, thisTest, i, m, np) ):
+        return False
 
-    else:
-        if ( options.only_serial and np > 1):
-            thisTest.skipped[0] = True
-            logInformation("  Parameter set 1 of 1 has np > 1, skipping ...")
-            return
+    runRoot = prepareRunRoot(thisTest, i)
+
+    # Prepare command
+    command = prepareSubtestCommand(options, thisTest, m)
+
+    # Run subtest
+    failed = runSubtest(command, thisTest, i, runRoot, getTimeout(options, thisTest))
+
+    if ( thisTest.skipped[i] ):
+        # The run was aborted, its output is incomplete.
+        finishRunRoot(thisTest, runRoot)
+        return False
 
-        logInformation("  Running parameter set 1 of 1 ...")
+    if ( failed ):
+        recordFailedParameterSet(options, thisTest, i, m, runRoot)
+        return False
 
-        command = prepareSubtestCommand(options, thisTest)
+    if ( options.timers or options.timers_all ):
+        moveTimersData(runRoot, options.dub_compiler)
 
-        runSubtest(command, thisTest, 0)
+    return True
 
-        if ( options.timers or options.timers_all ):
-            moveTimersData(thisTest.testRoot, options.dub_compiler)
+def recordFailedParameterSet(options, thisTest, i, m, runRoot):
+    """ Record and clean up a parameter set whose run failed, without comparing its output, which is missing or incomplete. """
+    logNotification("  Not comparing the output of a failed run ...")
+    recordSubtest(options, thisTest, i, m)
+    finishRunRoot(thisTest, runRoot)
+    countFailure(options)
 
+def postprocessParameterSet(options, thisTest, i, m, runRoot = None):
+    """ Compare, record and clean up a single parameter set of a test after it has been run, in runRoot if it is given. """
+    from coverage import mergeCovLsts
+
+    np = getSubtestNP(thisTest, m)
+    if ( not runRoot ):
+        runRoot = getRunRoot(thisTest, i)
+
+    try:
         if ( not options.coverage ):
             if ( not options.compare_none ):
-                compareSingleTest(options, thisTest)
+                compareTest(options, thisTest, i, m, np, runRoot)
         else:
-            if ( thisTest.errors[0] == 0 ):
+            if ( thisTest.errors[i] == 0 ):
                 covpath = constructCoveragePath(options.dlbc_root)
-                mergeCovLsts(options, thisTest.testRoot, covpath)
+                recordCoverage(options, thisTest, runRoot, m)
+                mergeCovLsts(options, runRoot, covpath)
             else:
                 logNotification("No succesful tests, not merging coverage information ...")
+    except SystemExit:
+        # A fatal error fails the parameter set, but its run time and result are still kept for the next run.
+        thisTest.errors[i] += 1
+        recordSubtest(options, thisTest, i, m)
+        raise
+
+    recordSubtest(options, thisTest, i, m)
 
-def runSubtest(command, thisTest, i):
-    """ Run a single parameter set for a single test. Returns number of errors encountered. """
+    finishRunRoot(thisTest, runRoot)
+
+    if ( thisTest.errors[i] > 0 ):
+        countFailure(options)
+
+def resetFailures():
+    """ Start counting failed parameter sets from zero, e.g. for the next run in watch mode. """
+    global failureCount
+    with failureLock:
+        failureCount = 0
+        failureLimitReached.clear()
+
+def countFailure(options):
+    """ Count a failed parameter set, and abort the running subtests if this reaches the failure limit. """
+    global failureCount
+    with failureLock:
+        failureCount += 1
+        if ( options.max_failures <= 0 or failureCount < options.max_failures or failureLimitReached.is_set() ):
+            return
+        failureLimitReached.set()
+        groups = list(runningGroups.items())
+    logError("Reached the limit of %d failed parameter set(s), aborting %d running subtest(s) ..." % ( options.max_failures, len(groups) ))
+    for pgid, aborted in groups:
+        killer = threading.Thread(target=killProcessGroup, args=(pgid, aborted))
+        killer.daemon = True
+        killer.start()
+
+def isIsolated(thisTest):
+    """ Parameter sets of a test with a parameter matrix, or of a test which shares its directory, are run in their own directories, so they can run concurrently. """
+    return ( thisTest.nSubtests > 1 or thisTest.isolated )
+
+def getRunRoot(thisTest, i):
+    """ Get the directory in which a parameter set is run. """
+    if ( isIsolated(thisTest) ):
+        return constructScratchPath(thisTest.testRoot, thisTest.name, i)
+    return thisTest.testRoot
+
+def prepareRunRoot(thisTest, i):
+    """ Prepare the directory to run a parameter set in.
+
+    For isolated parameter sets this is a scratch directory with symlinks to everything in the test directory
+    (input files, reference data, scripts), except for the paths that will be cleaned, which hold the output.
+    """
+    runRoot = getRunRoot(thisTest, i)
+    if ( runRoot == thisTest.testRoot ):
+        return runRoot
+    populateRunRoot(thisTest, runRoot)
+    logDebug("  Running parameter set %d in '%s'." % ( i + 1, runRoot ) )
+    return runRoot
+
+def populateRunRoot(thisTest, runRoot):
+    """ Create an empty directory runRoot with symlinks to the contents of the test directory, except for the output. """
+    if ( os.path.exists(runRoot) ):
+        shutil.rmtree(runRoot)
+    os.makedirs(runRoot)
+    private = [ os.path.basename(constructScratchRoot(thisTest.testRoot)) ] + [ os.path.normpath(c).split(os.sep)[0] for c in thisTest.clean ]
+    for f in os.listdir(thisTest.testRoot):
+        if ( f not in private ):
+            os.symlink(os.path.join(thisTest.testRoot, f), os.path.join(runRoot, f))
+
+def finishRunRoot(thisTest, runRoot):
+    """ Move the output of an isolated parameter set back into the test directory and remove its scratch directory. """
+    if ( runRoot == thisTest.testRoot ):
+        return
+    with runRootLock:
+        mergeTree(runRoot, thisTest.testRoot)
+    shutil.rmtree(runRoot)
+    try:
+        os.rmdir(constructScratchRoot(thisTest.testRoot))
+    except OSError:
+        # Other parameter sets are still running
+        pass
+
+def mergeTree(source, target):
+    """ Move everything but symlinks from source into target, merging directories. """
+    for f in os.listdir(source):
+        s = os.path.join(source, f)
+        t = os.path.join(target, f)
+        if ( os.path.islink(s) ):
+            continue
+        if ( os.path.isdir(s) and os.path.isdir(t) ):
+            mergeTree(s, t)
+        else:
+            if ( os.path.isfile(t) ):
+                os.remove(t)
+            shutil.move(s, t)
+
+def runSubtest(command, thisTest, i, runRoot = None, timeout = None):
+    """ Run a single parameter set for a single test, in the test directory unless runRoot is given.
+
+    The command runs in its own process group, which is killed as a whole if it takes longer than timeout seconds,
+    if DLBC reports a fatal error on its output, or if the failure limit is reached by other subtests.
+    The resources used by the command and the processes it waited for (i.e. all ranks) are stored in thisTest.resources.
+    Returns True if the run failed.
+    """
+    if ( not runRoot ):
+        runRoot = thisTest.testRoot
+    returncode, timeElapsed, resources, killed = launchCommand(command, runRoot, timeout)
+    thisTest.timers[i] = timeElapsed
+    thisTest.returncodes[i] = returncode
+    thisTest.resources[i] = resources
+    return checkSubtest(thisTest, i, killed, timeout)
+
+def launchCommand(command, cwd, timeout = None):
+    """ Run a command in its own process group and wait for it to finish, passing on its output.
+
+    Returns the return code, the wall time, the resources used and the reason it was killed for: None, "aborted", "timedOut" or "fatal".
+    """
     import time
     logDebug("  Executing '" + " ".join(command) + "'")
     t0 = time.time()
-    p = subprocess.Popen(command, cwd=thisTest.testRoot)
-    p.communicate()
+    p = subprocess.Popen(command, cwd=cwd, preexec_fn=os.setsid, stdout=subprocess.PIPE, universal_newlines=True)
+    timedOut = threading.Event()
+    fatal = threading.Event()
+    aborted = threading.Event()
+    with failureLock:
+        runningGroups[p.pid] = aborted
+        if ( failureLimitReached.is_set() ):
+            killProcessGroup(p.pid, aborted, 0.0)
+    reader = threading.Thread(target=streamOutput, args=(p, fatal))
+    reader.daemon = True
+    reader.start()
+    if ( timeout ):
+        killer = threading.Timer(timeout, killProcessGroup, [ p.pid, timedOut ])
+        killer.daemon = True
+        killer.start()
+    status, rusage = waitForProcess(p)
+    if ( timeout ):
+        killer.cancel()
+    with failureLock:
+        del runningGroups[p.pid]
+    reader.join()
     timeElapsed = time.time() - t0
-    thisTest.timers[i] = timeElapsed
-    if ( p.returncode != 0 ):
-        logError("DLBC returned %d" % p.returncode)
+    resources = {
+        "utime": rusage.ru_utime,
+        "stime": rusage.ru_stime,
+        "maxrss": rusage.ru_maxrss * 1024, # Linux reports kilobytes
+        "readBytes": rusage.ru_inblock * 512, # Linux counts blocks of 512 bytes
+        "writeBytes": rusage.ru_oublock * 512,
+        "timedOut": timedOut.is_set(),
+    }
+    killed = None
+    if ( aborted.is_set() ):
+        killed = "aborted"
+    elif ( timedOut.is_set() ):
+        killed = "timedOut"
+    elif ( fatal.is_set() ):
+        killed = "fatal"
+    return p.returncode, timeElapsed, resources, killed
+
+def checkSubtest(thisTest, i, killed, timeout = None):
+    """ Count an error for a parameter set which failed to run, or mark it as skipped if it was aborted. Returns True if the run failed. """
+    failed = False
+    if ( killed == "aborted" ):
+        logNotification("  DLBC was killed because the failure limit has been reached.")
+        thisTest.skipped[i] = True
+    elif ( killed == "timedOut" ):
+        logError("DLBC did not finish within %d seconds and was killed." % timeout)
+        thisTest.errors[i] += 1
+        failed = True
+    elif ( killed == "fatal" ):
+        logError("DLBC reported a fatal error and was killed.")
         thisTest.errors[i] += 1
-    logInformation("  Took %f seconds." % timeElapsed)
+        failed = True
+    elif ( thisTest.returncodes[i] != 0 ):
+        logError("DLBC returned %d" % thisTest.returncodes[i])
+        thisTest.errors[i] += 1
+        failed = True
+    logInformation("  Took %f seconds." % thisTest.timers[i])
+    return failed
+
+def waitForProcess(p):
+    """ Wait for a process started by Popen to finish, returning its status and resource usage. """
+    import errno
+    while ( True ):
+        try:
+            pid, status, rusage = os.wait4(p.pid, 0)
+            break
+        except OSError as e:
+            if ( e.errno != errno.EINTR ):
+                raise
+    if ( os.WIFSIGNALED(status) ):
+        p.returncode = -os.WTERMSIG(status)
+    else:
+        p.returncode = os.WEXITSTATUS(status)
+    return status, rusage
+
+def streamOutput(p, fatal):
+    """ Pass on the output of a process while it runs, and kill its process group as soon as it reports a fatal error.
+
+    A rank which encounters a fatal error exits, but the other ranks may wait for it until the run times out.
+    """
+    for line in iter(p.stdout.readline, ""):
+        # Whole lines only, so the output of concurrent subtests and the log messages do not interleave mid-line.
+        with logLock:
+            sys.stdout.write(line)
+            sys.stdout.flush()
+        if ( not fatal.is_set() and fatalMarker.search(line) ):
+            killer = threading.Thread(target=killProcessGroup, args=(p.pid, fatal))
+            killer.daemon = True
+            killer.start()
+    p.stdout.close()
+
+def killProcessGroup(pgid, killed, grace = 10.0):
+    """ Terminate a process group, and kill it if it is still alive after grace seconds. The event killed is set first. """
+    import signal
+    import time
+    killed.set()
+    logDebug("  Terminating process group %d ..." % pgid)
+    try:
+        os.killpg(pgid, signal.SIGTERM)
+        t0 = time.time()
+        while ( time.time() - t0 < grace ):
+            time.sleep(0.1)
+            # Signal 0 only checks if any process in the group is still alive.
+            os.killpg(pgid, 0)
+        logDebug("  Killing process group %d ..." % pgid)
+        os.killpg(pgid, signal.SIGKILL)
+    except OSError:
+        # The whole group has exited.
+        pass
+
+def getTimeout(options, thisTest):
+    """ Get the timeout for a parameter set: the timeout of the test if it is specified, the default otherwise. """
+    if ( thisTest.timeout ):
+        return thisTest.timeout
+    return options.timeout
+
+def sumResources(resources):
+    """ Combine the resources used by several parameter sets: the times and bytes are added, the peak memory is the maximum. """
+    resources = [ r for r in resources if r ]
+    if ( not resources ):
+        return None
+    total = {}
+    for key in [ "utime", "stime", "readBytes", "writeBytes" ]:
+        total[key] = sum([ r[key] for r in resources ])
+    total["maxrss"] = max([ r["maxrss"] for r in resources ])
+    total["timedOut"] = any([ r["timedOut"] for r in resources ])
+    return total
+
+def formatResources(resources):
+    """ Format CPU time, peak memory and I/O of a parameter set for the run timers report. """
+    if ( not resources ):
+        return " %12s %12s %12s" % ( "---", "---", "---" )
+    mb = 1024.0 * 1024.0
+    return " %12e %12.1f %12.1f" % ( resources["utime"] + resources["stime"], resources["maxrss"] / mb, ( resources["readBytes"] + resources["writeBytes"] ) / mb )
 
 def getNC(map):
     """ Get nc from parallel.nc if available. """
@@ -109,6 +397,21 @@ def getNC(map):
             return p[1]
     return "[0,0]"
 
+def getSubtestNP(thisTest, m = None):
+    """ Get the number of ranks for a parameter set: the product of parallel.nc if available, np otherwise. """
+    if ( m ):
+        nc = getNC(m)
+        np = reduce(lambda x, y: int(x) * int(y), nc[1:-1].split(","), 1)
+        if ( np > 0 ):
+            return np
+    return thisTest.np
+
+def getTestNP(thisTest):
+    """ Get the largest number of ranks required by any parameter set of a test. """
+    if ( thisTest.parameters ):
+        return max([ getSubtestNP(thisTest, m) for m in mapParameterMatrix(thisTest) ])
+    return thisTest.np
+
 def mapParameterMatrix(thisTest):
     """ Construct the cartesian product of all parameter values. """
     tuples = []
@@ -137,6 +440,10 @@ def cleanTest(thisTest):
         if ( os.path.exists(f) ):
             logDebug("  Removing '%s'" % f )
             os.remove(f)
+    scratch = constructScratchRoot(testRoot)
+    if ( os.path.exists(scratch) ):
+        logDebug("  Removing '%s'" % scratch )
+        shutil.rmtree(scratch)
     src = os.path.join(testRoot, "src")
     if ( os.path.exists(src) ):
         os.remove(src)
@@ -147,9 +454,13 @@ def cleanTest(thisTest):
             os.remove(f)
 
 def prepareSubtestCommand(options, thisTest, m = None):
+    """ Construct the mpirun command line to run a parameter set. """
+    return [ "mpirun", "-np", str(thisTest.np) ] + prepareDLBCCommand(options, thisTest, m)
 
+def prepareDLBCCommand(options, thisTest, m = None):
+    """ Construct the DLBC command line (executable and arguments) to run a parameter set. """
     exePath = constructExeTargetPath(thisTest.configuration, options.dub_build, options.dub_compiler, options.dlbc_root)
-    command = [ "mpirun", "-np", str(thisTest.np), exePath, "-p", thisTest.inputFile, "-v", options.dlbc_verbosity, "--parameter", "timers.enableIO=true"]
+    command = [ exePath, "-p", thisTest.inputFile, "-v", options.dlbc_verbosity, "--parameter", "timers.enableIO=true"]
 
     if ( thisTest.parameters ):
         command = command + constructParameterCommand(m)
@@ -208,6 +519,7 @@ def checkpointCommand(options, thisTest):
 def reportRunTimers(testList, warnTime):
     totalTime = 0.0
     timeWarnings = 0
+    timeouts = 0
 
     tests = 0
     skipped = 0
@@ -218,8 +530,8 @@ def reportRunTimers(testList, warnTime):
         tnlen = max(max([len(t.timerName) for t in testList]), 16) # 16 is the length of a parameter set name
 
         logNotification("\n" + "="*80 + "\n")
-        logNotification("  %*s %12s" % (tnlen, "test", "time (s)"))
-        logNotification("%s" % "_"*(tnlen+15))
+        logNotification("  %*s %12s %12s %12s %12s" % (tnlen, "test", "time (s)", "cpu (s)", "rss (MB)", "io (MB)"))
+        logNotification("%s" % "_"*(tnlen+54))
 
         for test in sorted(testList, key=lambda test: test.timerName):
             nSubtests = test.nSubtests
@@ -228,6 +540,7 @@ def reportRunTimers(testList, warnTime):
 
             time = sum(test.timers)
             err = sum(test.errors)
+            resources = sumResources(test.resources)
             totalTime += time
             prefix = " "
 
@@ -236,7 +549,11 @@ def reportRunTimers(testList, warnTime):
                     prefix = "!"
                     timeWarnings += 1
 
-                if ( err > 0 ):
+                if ( resources and resources["timedOut"] ):
+                    prefix = "T"
+                    timeouts += 1
+                    errors += 1
+                elif ( err > 0 ):
                     prefix = "X"
                     errors += 1
                 elif ( test.skipped[0] ):
@@ -247,11 +564,11 @@ def reportRunTimers(testList, warnTime):
                     disabled += 1
 
                 if ( time == 0 ):
-                    logNotification("%s %*s %12s" % (prefix, tnlen, test.timerName, "---"))
+                    logNotification("%s %*s %12s" % (prefix, tnlen, test.timerName, "---") + formatResources(resources))
                 else:
-                    logNotification("%s %*s %12e" % (prefix, tnlen, test.timerName, time))
+                    logNotification("%s %*s %12e" % (prefix, tnlen, test.timerName, time) + formatResources(resources))
             else:
-                logNotification("%s %*s %12e" % (prefix, tnlen, test.timerName, time))
+                logNotification("%s %*s %12e" % (prefix, tnlen, test.timerName, time) + formatResources(resources))
 
                 for i in range(0, nSubtests):
 
@@ -259,7 +576,11 @@ def reportRunTimers(testList, warnTime):
                         prefix = "!"
                         timeWarnings += 1
 
-                    if ( test.errors[i] > 0 ):
+                    if ( test.resources[i] and test.resources[i]["timedOut"] ):
+                        prefix = "T"
+                        timeouts += 1
+                        errors += 1
+                    elif ( test.errors[i] > 0 ):
                         prefix = "X"
                         errors += 1
                     elif ( test.skipped[i] ):
@@ -269,11 +590,11 @@ def reportRunTimers(testList, warnTime):
                     name = "Parameter set %2d" % ( i + 1 )
                     time = test.timers[i]
                     if ( time == 0 ):
-                        logNotification("%s %*s %12s" % (prefix, tnlen, name, "---"))
+                        logNotification("%s %*s %12s" % (prefix, tnlen, name, "---") + formatResources(test.resources[i]))
                     else:
-                        logNotification("%s %*s %12e" % (prefix, tnlen, name, time))
+                        logNotification("%s %*s %12e" % (prefix, tnlen, name, time) + formatResources(test.resources[i]))
 
-        logNotification("%s" % "_"*(tnlen+15))
+        logNotification("%s" % "_"*(tnlen+54))
 
         import time
         fTime = time.strftime("%H:%M:%S", time.gmtime(totalTime))
@@ -290,6 +611,11 @@ def reportRunTimers(testList, warnTime):
     else:
         logNotification("  Encountered zero time warnings (t > %.1f seconds)." % warnTime)
 
+    if ( timeouts == 1 ):
+        logNotification("  Encountered %d timeout." % timeouts)
+    elif ( timeouts > 1 ):
+        logNotification("  Encountered %d timeouts." % timeouts)
+
     if ( errors == 1 ):
         logNotification("  Encountered %d error." % errors)
     elif ( errors > 1 ):
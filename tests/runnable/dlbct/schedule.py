@@ -0,0 +1,118 @@
+#!/usr/bin/env python
+
+"""
+Run interdependent jobs concurrently on a limited number of cores.
+"""
+
+import threading
+
+from logging import *
+
+class Job:
+
+    returncode = None
+    finished = False
+    stage = None
+
+    def __init__(self, name, np, function, *args):
+        """ A job calls function(*args) and occupies np cores while doing so. """
+        self.name = name
+        self.np = np
+        self.function = function
+        self.args = args
+        self.dependencies = []
+
+    def dependsOn(self, *jobs):
+        """ Only start this job after the given jobs have finished. """
+        self.dependencies += jobs
+
+    def isReady(self):
+        """ Check if all dependencies have finished. """
+        return all([ d.finished for d in self.dependencies ])
+
+    def run(self):
+        """ Execute the job, catching fatal errors so they can be handled by the scheduler. """
+        try:
+            self.function(*self.args)
+            self.returncode = 0
+        except SystemExit as e:
+            # logFatal calls exit(), which only ends the current thread.
+            if ( e.code ):
+                self.returncode = e.code
+            else:
+                self.returncode = -1
+        except Exception:
+            import traceback
+            logError("Job '%s' raised an exception:\n%s" % ( self.name, traceback.format_exc() ) )
+            self.returncode = -1
+
+class Scheduler:
+
+    def __init__(self, cores, backlog = None):
+        """ Schedule jobs on a number of cores.
+
+        If backlog is given, jobs of the "run" stage are held back while that many jobs of the "postprocess" stage
+        are waiting for a core, which bounds the amount of output waiting to be processed.
+        """
+        self.cores = max(1, cores)
+        self.backlog = backlog
+        self.free = self.cores
+        self.pending = []
+        self.running = []
+        self.fatal = None
+        self.condition = threading.Condition()
+
+    def fits(self, job):
+        """ Check if a job can be started right now. """
+        if ( job.stage == "run" and self.backlog is not None ):
+            waiting = len([ j for j in self.pending if j.stage == "postprocess" and j.isReady() ])
+            if ( waiting >= self.backlog ):
+                return False
+        return ( job.isReady() and self.getCores(job) <= self.free )
+
+    def getCores(self, job):
+        """ Jobs which are wider than the core budget get the whole budget to themselves. """
+        return min(max(0, job.np), self.cores)
+
+    def start(self, job):
+        """ Reserve cores for a job and start it in its own thread. """
+        self.free -= self.getCores(job)
+        self.running.append(job)
+        logDebug("Starting job '%s' on %d core(s), %d of %d core(s) remain free ..." % ( job.name, self.getCores(job), self.free, self.cores ) )
+        thread = threading.Thread(target=self.execute, args=(job,))
+        thread.daemon = True
+        thread.start()
+
+    def execute(self, job):
+        """ Thread body: run a job and release its resources. """
+        job.run()
+        with self.condition:
+            self.free += self.getCores(job)
+            self.running.remove(job)
+            job.finished = True
+            if ( job.returncode != 0 and self.fatal is None ):
+                self.fatal = job
+            self.condition.notify()
+
+    def run(self, jobs):
+        """ Run all jobs, starting them in the order given whenever they are ready and fit (first-fit).
+
+        If a job ends fatally, no new jobs are started, the running jobs are allowed to finish
+        and the program exits with the return code of the failed job, like the serial run would.
+        """
+        self.pending = list(jobs)
+        with self.condition:
+            while ( self.pending or self.running ):
+                if ( self.fatal is None ):
+                    for job in list(self.pending):
+                        if ( self.fits(job) ):
+                            self.pending.remove(job)
+                            self.start(job)
+                if ( self.pending and not self.running and self.fatal is None ):
+                    logFatal("Jobs '%s' can never be started, their dependencies are not scheduled." % "', '".join([ j.name for j in self.pending ]), -1)
+                # A timeout makes the wait interruptible by KeyboardInterrupt.
+                self.condition.wait(1.0)
+                if ( self.fatal is not None and not self.running ):
+                    break
+        if ( self.fatal is not None ):
+            logFatal("Job '%s' failed fatally, %d job(s) were not started." % ( self.fatal.name, len(self.pending) ), self.fatal.returncode)
@@ -0,0 +1,146 @@
+#!/usr/bin/env python
+
+"""
+Select tests with expressions over their indexed attributes, e.g. "tag:laplace and configuration:d3q19 and np>1 and not disabled".
+
+Terms are combined with 'and', 'or', 'not' and parentheses:
+  tag:PATTERN            the test has a tag matching PATTERN
+  name:PATTERN           the name of the test matches PATTERN
+  configuration:PATTERN  the configuration of the test matches PATTERN
+  path:PATTERN           a directory below tests/ on the path of the test matches PATTERN
+  np OP N, subtests OP N the number of ranks or parameter sets compares to N, with OP one of = == != < <= > >=
+  disabled               the test is disabled
+Patterns may contain shell wildcards, e.g. "configuration:d3*".
+"""
+
+import fnmatch
+import operator
+import os
+import re
+
+from logging import *
+
+# Directory of the runnable tests, which paths are relative to.
+testsRoot = os.path.join(os.path.dirname(os.path.dirname(os.path.realpath(__file__))), "tests")
+
+# Attributes matched against a pattern, as a function of the test returning a list of values.
+patternFields = {
+    "configuration": lambda test: [ test.configuration ],
+    "name": lambda test: [ test.name ],
+    "path": lambda test: os.path.relpath(test.testRoot, testsRoot).split(os.sep),
+    "tag": lambda test: test.tags,
+}
+
+# Attributes compared to a number.
+numberFields = {
+    "np": lambda test: int(test.np),
+    "subtests": lambda test: test.nSubtests,
+}
+
+# Attributes which are true or false.
+flagFields = {
+    "disabled": lambda test: test.disabled,
+}
+
+comparisons = {
+    "=": operator.eq,
+    "==": operator.eq,
+    "!=": operator.ne,
+    "<": operator.lt,
+    "<=": operator.le,
+    ">": operator.gt,
+    ">=": operator.ge,
+}
+
+tokenPattern = re.compile(r"\s*(\(|\)|\w+\s*:\s*[^\s()]+|\w+\s*(?:<=|>=|==|!=|=|<|>)\s*-?\d+|\w+)")
+
+def tokenizeSelection(expression):
+    """ Split a selection into parentheses, keywords and terms. """
+    tokens = []
+    position = 0
+    expression = expression.strip()
+    while ( position < len(expression) ):
+        match = tokenPattern.match(expression, position)
+        if ( not match ):
+            logFatal("Selection '%s' cannot be parsed at '%s'." % ( expression, expression[position:] ), -1)
+        tokens.append(match.group(1))
+        position = match.end()
+    return tokens
+
+def parseTerm(expression, token):
+    """ Turn a single term into a function of the test. """
+    if ( ":" in token ):
+        field, pattern = [ s.strip() for s in token.split(":", 1) ]
+        if ( field not in patternFields ):
+            logFatal("Selection '%s' uses unknown field '%s', choose from %s." % ( expression, field, ", ".join(sorted(patternFields)) ), -1)
+        values = patternFields[field]
+        return lambda test: any([ fnmatch.fnmatch(str(v), pattern) for v in values(test) ])
+    match = re.match(r"(\w+)\s*(<=|>=|==|!=|=|<|>)\s*(-?\d+)$", token)
+    if ( match ):
+        field, op, number = match.groups()
+        if ( field not in numberFields ):
+            logFatal("Selection '%s' compares unknown field '%s', choose from %s." % ( expression, field, ", ".join(sorted(numberFields)) ), -1)
+        value = numberFields[field]
+        compare = comparisons[op]
+        return lambda test: compare(value(test), int(number))
+    if ( token in flagFields ):
+        return flagFields[token]
+    logFatal("Selection '%s' contains unknown term '%s'." % ( expression, token ), -1)
+
+def parseSelection(expression):
+    """ Parse a selection into a function which returns True for the tests it selects. """
+    tokens = tokenizeSelection(expression)
+    position = [ 0 ]
+
+    def peek():
+        if ( position[0] < len(tokens) ):
+            return tokens[position[0]]
+        return None
+
+    def take():
+        token = peek()
+        if ( token is None ):
+            logFatal("Selection '%s' ends unexpectedly." % expression, -1)
+        position[0] += 1
+        return token
+
+    def parseOr():
+        terms = [ parseAnd() ]
+        while ( peek() == "or" ):
+            take()
+            terms.append(parseAnd())
+        if ( len(terms) == 1 ):
+            return terms[0]
+        return lambda test: any([ t(test) for t in terms ])
+
+    def parseAnd():
+        terms = [ parseNot() ]
+        while ( peek() == "and" ):
+            take()
+            terms.append(parseNot())
+        if ( len(terms) == 1 ):
+            return terms[0]
+        return lambda test: all([ t(test) for t in terms ])
+
+    def parseNot():
+        if ( peek() == "not" ):
+            take()
+            term = parseNot()
+            return lambda test: not term(test)
+        return parseAtom()
+
+    def parseAtom():
+        token = take()
+        if ( token == "(" ):
+            term = parseOr()
+            if ( take() != ")" ):
+                logFatal("Selection '%s' lacks a closing parenthesis." % expression, -1)
+            return term
+        if ( token in [ ")", "and", "or", "not" ] ):
+            logFatal("Selection '%s' has '%s' where a term is expected." % ( expression, token ), -1)
+        return parseTerm(expression, token)
+
+    selection = parseOr()
+    if ( peek() is not None ):
+        logFatal("Selection '%s' has unexpected '%s'." % ( expression, peek() ), -1)
+    return selection
@@ -0,0 +1,112 @@
+#!/usr/bin/env python
+
+"""
+Split the parameter sets of the test suite into shards, to spread them over several machines.
+
+The shards are balanced by the run times in a shared file, tests/shard-timings.json, which is committed with the tests
+rather than taken from the results database of each machine, so separate machines agree on the shards. The parameter
+sets with a run time are dealt out longest first, each to the shard with the least run time so far (LPT); those without
+one are assigned by a hash of their test name and parameters. Ties are broken by the same hash, so the assignment is a
+pure function of the tests and the file.
+"""
+
+import hashlib
+import json
+import os
+
+from logging import *
+from path import constructShardTimingsPath
+from results import encodeParameters
+from run import getSubtestNP, mapParameterMatrix
+
+def parseShard(shard):
+    """ Parse a shard specification 'k/n' into (k, n). """
+    try:
+        k, n = [ int(s) for s in shard.split("/") ]
+    except ValueError:
+        logFatal("Shard '%s' should be of the form k/n, e.g. 1/4." % shard, -1)
+    if ( n < 1 or k < 1 or k > n ):
+        logFatal("Shard '%s' should have 1 <= k <= n." % shard, -1)
+    return k, n
+
+def listShardUnits(options, tests, singleTest):
+    """ List (test, index, parameter set) for all parameter sets that would be run without sharding. """
+    units = []
+    for test in tests:
+        if ( test.disabled and not singleTest ):
+            continue
+        if ( options.only_tag and ( not options.only_tag in test.tags ) ):
+            continue
+        if ( test.parameters ):
+            maps = list(enumerate(mapParameterMatrix(test)))
+        else:
+            maps = [ ( 0, None ) ]
+        for i, m in maps:
+            if ( options.only_first and test.parameters and i > 0 ):
+                continue
+            if ( options.only_serial and getSubtestNP(test, m) > 1 ):
+                continue
+            units.append(( test, i, m ))
+    return units
+
+def getShardKey(test, m):
+    """ Identify a parameter set in the shard timings. """
+    return "%s %s" % ( test.name, encodeParameters(m) )
+
+def getShardHash(test, m):
+    """ Hash the test name and parameters of a parameter set into an integer. """
+    return int(hashlib.sha1(getShardKey(test, m).encode("utf-8")).hexdigest(), 16)
+
+def loadShardTimings(dlbcRoot):
+    """ Load the shared run times of the parameter sets, or return an empty dictionary if there are none. """
+    try:
+        with open(constructShardTimingsPath(dlbcRoot)) as f:
+            return json.load(f)
+    except ( IOError, ValueError ):
+        logDebug("No shard timings found, shards will be balanced by the number of parameter sets.")
+        return {}
+
+def saveShardTimings(options):
+    """ Add the most recent run times from the results database to the shared run times, to be committed for the other machines. """
+    timings = loadShardTimings(options.dlbc_root)
+    for ( name, parameters ), wallTime in options.timings.items():
+        timings["%s %s" % ( name, parameters )] = round(wallTime, 3)
+    timingsPath = constructShardTimingsPath(options.dlbc_root)
+    temporaryPath = "%s.%d" % ( timingsPath, os.getpid() )
+    with open(temporaryPath, "w") as f:
+        json.dump(timings, f, indent=2, sort_keys=True, separators=( ",", ": " ))
+        f.write("\n")
+    os.rename(temporaryPath, timingsPath)
+    logNotification("Wrote the run times of %d parameter sets to '%s'." % ( len(timings), timingsPath ))
+
+def assignShards(options, tests, singleTest, n):
+    """ Assign each parameter set to one of n shards. Returns a list of n sets of (test name, index).
+
+    The assignment only depends on the test names, parameter sets and shard timings, so every machine computes the same shards.
+    """
+    units = listShardUnits(options, tests, singleTest)
+    timings = loadShardTimings(options.dlbc_root)
+    shards = [ set() for k in range(n) ]
+    loads = [ 0.0 ] * n
+    timed = []
+    for test, i, m in units:
+        key = getShardKey(test, m)
+        if ( key in timings ):
+            timed.append(( -timings[key], getShardHash(test, m), test.name, i ))
+        else:
+            shards[getShardHash(test, m) % n].add(( test.name, i ))
+    for negativeTime, h, name, i in sorted(timed):
+        k = min(range(n), key=lambda k: ( loads[k], ( h + k ) % n ))
+        shards[k].add(( name, i ))
+        loads[k] -= negativeTime
+    for k in range(n):
+        logDebug("Shard %d/%d: %d parameter sets, %f seconds of known run time." % ( k + 1, n, len(shards[k]), loads[k] ))
+    return shards
+
+def selectShard(options, tests, singleTest):
+    """ Determine the set of (test name, index) which should be run for --shard k/n. """
+    k, n = parseShard(options.shard)
+    shards = assignShards(options, tests, singleTest, n)
+    total = sum([ len(s) for s in shards ])
+    logNotification("Running shard %d of %d: %d of %d parameter sets." % ( k, n, len(shards[k-1]), total ))
+    return shards[k-1]
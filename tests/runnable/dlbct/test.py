@@ -12,6 +12,12 @@ class Test:
     skipped = None
     timers = None
     errors = None
+    returncodes = None
+    resources = None
+    comparisons = None
+    prepared = False
+    # Set for tests which share their directory with other tests that run at the same time.
+    isolated = False
 
     def __init__(self, testRoot, fileName):
         self.testRoot = testRoot
@@ -111,6 +117,12 @@ class Test:
             logDebug("JSON file '%s' lacks a 'fast' parameter. Assuming no special options are needed." % self.filePath)
             self.fast = None
 
+        try:
+            self.timeout = self.data["timeout"]
+        except KeyError:
+            logDebug("JSON file '%s' lacks a 'timeout' parameter. Using the default timeout." % self.filePath)
+            self.timeout = None
+
         if ( "disabled" in self.fileName ):
             self.disabled = True
 
@@ -122,6 +134,9 @@ class Test:
         self.errors = [ 0 ] * self.nSubtests
         self.timers = [ 0 ] * self.nSubtests
         self.skipped = [ False ] * self.nSubtests
+        self.returncodes = [ None ] * self.nSubtests
+        self.resources = [ None ] * self.nSubtests
+        self.comparisons = [ [] for i in range(self.nSubtests) ]
 
     def describe(self, n, i, withLines=False):
         """ Print pretty description for single test. """
@@ -143,8 +158,35 @@ class Unittest(Test):
         self.errors = [ 0 ]
         self.timers = [ 0 ]
         self.skipped = [ 0 ]
+        self.returncodes = [ None ]
+        self.resources = [ None ]
+        self.comparisons = [ [] ]
         self.timerName = name
         self.nSubtests = 1
-        
 
-        
+class IndexedTest(Test):
+
+    def __init__(self, testRoot, fileName, entry):
+        """ A test known from its entry in the test index, without parsing its JSON file. Call load() for the full test. """
+        self.testRoot = testRoot
+        self.fileName = fileName
+        self.filePath = os.path.join(testRoot, fileName)
+        self.name = entry["name"]
+        self.description = entry["description"]
+        self.configuration = entry["configuration"]
+        self.tags = entry["tags"]
+        self.latex = entry["latex"]
+        self.np = entry["np"]
+        self.nSubtests = entry["nSubtests"]
+        self.disabled = entry["disabled"]
+        self.timerName = os.path.relpath(os.path.join(testRoot, self.name), "tests")
+        self.errors = [ 0 ] * self.nSubtests
+        self.timers = [ 0 ] * self.nSubtests
+        self.skipped = [ False ] * self.nSubtests
+        self.returncodes = [ None ] * self.nSubtests
+        self.resources = [ None ] * self.nSubtests
+        self.comparisons = [ [] for i in range(self.nSubtests) ]
+
+    def load(self):
+        """ Parse the JSON file of the test. """
+        return Test(self.testRoot, self.fileName)
@@ -0,0 +1,164 @@
+#!/usr/bin/env python
+
+"""
+Watch the DLBC sources and the tests for changes, and rerun only the tests affected by them.
+"""
+
+import fnmatch
+import os
+import time
+
+import build
+from incremental import getShellScripts
+from index import findTests, selectTests
+from logging import *
+
+# Seconds between two scans for changes.
+watchInterval = 1.0
+
+# Tests affected by a change to a D module below src/dlbc, as ( module pattern, kind, value ).
+# Kind "tag" selects the tests with that tag, kind "path" the tests in a directory of that name.
+# Modules which match none of the patterns (e.g. lattice.d or parallel.d) may affect any test.
+moduleTests = [
+    ( "elec/*.d", "path", "elec" ),
+    ( "io/checkpoint.d", "path", "technical" ),
+    ( "lb/advection.d", "tag", "advection" ),
+    ( "lb/collision.d", "tag", "collision" ),
+    ( "lb/eqdist.d", "tag", "eqdist" ),
+    ( "lb/force.d", "tag", "force" ),
+    ( "lb/init.d", "tag", "init" ),
+    ( "lb/laplace.d", "tag", "laplace" ),
+    ( "lb/mask.d", "tag", "init" ),
+]
+
+def getSourceRoot(options):
+    """ Get the directory of the DLBC modules. """
+    return os.path.join(options.dlbc_root, "src", "dlbc")
+
+def listSources(options):
+    """ List the files which require a rebuild when they change: the D modules and dub.json. """
+    sources = [ os.path.join(options.dlbc_root, "dub.json") ]
+    for root, dirnames, filenames in os.walk(getSourceRoot(options)):
+        sources += [ os.path.join(root, f) for f in fnmatch.filter(filenames, "*.d") ]
+    return sources
+
+def listTestFiles(options, thisTest):
+    """ List the files a test depends on: its JSON file, input file, reference data and scripts. Output is not included, so runs do not trigger themselves. """
+    files = [ thisTest.filePath, os.path.join(thisTest.testRoot, thisTest.inputFile) ]
+    for root, dirnames, filenames in os.walk(os.path.join(thisTest.testRoot, "reference-data")):
+        files += [ os.path.join(root, f) for f in filenames ]
+    files += getShellScripts(options, thisTest)
+    if ( thisTest.plot ):
+        files += [ os.path.join(thisTest.testRoot, p) for p in thisTest.plot ]
+    return files
+
+def scanFiles(paths):
+    """ Get the modification time and size of each existing file. """
+    snapshot = {}
+    for path in paths:
+        try:
+            stat = os.stat(path)
+        except OSError:
+            continue
+        snapshot[path] = ( stat.st_mtime, stat.st_size )
+    return snapshot
+
+def scanTests(options, searchRoot):
+    """ Find the tests and take a snapshot of the files they depend on. Returns the tests, the snapshot and the tests depending on each file. """
+    tests, singleTest = findTests(options, searchRoot)
+    allTests, tests = selectTests(options, tests)
+    owners = {}
+    for test in tests:
+        for f in listTestFiles(options, test):
+            owners.setdefault(f, []).append(test)
+    return tests, scanFiles(owners.keys()), owners
+
+def findChanges(old, new):
+    """ List the files which have been added, removed or modified between two snapshots. """
+    return sorted([ f for f in set(old) | set(new) if old.get(f) != new.get(f) ])
+
+def getModuleTests(module, tests):
+    """ Get the tests affected by a change to a D module, or None if it may affect any test. """
+    selectors = [ ( kind, value ) for pattern, kind, value in moduleTests if fnmatch.fnmatch(module, pattern) ]
+    if ( not selectors ):
+        return None
+    affected = []
+    for test in tests:
+        for kind, value in selectors:
+            if ( ( kind == "tag" and value in test.tags ) or ( kind == "path" and value in test.testRoot.split(os.sep) ) ):
+                affected.append(test)
+                break
+    return affected
+
+def getAffectedTests(options, tests, owners, sources, changed):
+    """ Get the tests affected by a list of changed files, in the order of tests. Changed sources are looked up in moduleTests. """
+    sourceRoot = getSourceRoot(options)
+    affected = set()
+    for path in changed:
+        if ( path in owners ):
+            logInformation("  '%s' changed." % os.path.relpath(path))
+            affected.update([ test.filePath for test in owners[path] ])
+            continue
+        if ( path not in sources ):
+            # A file of a test which has been removed.
+            continue
+        module = os.path.relpath(path, sourceRoot)
+        selected = getModuleTests(module, tests)
+        if ( selected is None ):
+            logInformation("  '%s' changed, which may affect all tests." % module)
+            affected.update([ test.filePath for test in tests ])
+        else:
+            logInformation("  '%s' changed, which affects %d test(s)." % ( module, len(selected) ))
+            affected.update([ test.filePath for test in selected ])
+    return [ test for test in tests if test.filePath in affected ]
+
+def watchTests(options, searchRoot, runTests):
+    """ Scan for changes until interrupted, and call runTests(tests) with the tests affected by each change.
+
+    Changed sources change the hash of the executables, so the affected tests, and only those, get rebuilt ones.
+    Without the executable cache, a rebuild of the executables used by the affected tests is forced instead.
+    """
+    from run import resetFailures
+    sources = scanFiles(listSources(options))
+    tests, files, owners = scanTests(options, searchRoot)
+    logNotification("Watching %d source files and %d tests for changes, press Ctrl-C to stop ..." % ( len(sources), len(tests) ))
+    try:
+        while ( True ):
+            time.sleep(watchInterval)
+            newSources = scanFiles(listSources(options))
+            try:
+                newTests, newFiles, newOwners = scanTests(options, searchRoot)
+            except SystemExit:
+                # A JSON file is broken, most likely while it is being edited.
+                continue
+            changedSources = findChanges(sources, newSources)
+            changed = changedSources + findChanges(files, newFiles)
+            if ( not changed ):
+                continue
+            rebuild = ( len(changedSources) > 0 )
+            sources, tests, files, owners = newSources, newTests, newFiles, newOwners
+            if ( rebuild ):
+                build.resetBuilds()
+
+            logNotification("\n" + "="*80)
+            logNotification("Detected changes to %d file(s) ..." % len(changed))
+            affected = getAffectedTests(options, tests, owners, changedSources, changed)
+            if ( not affected ):
+                logNotification("No tests are affected.")
+                continue
+
+            logNotification("Rerunning %d affected test(s) ..." % len(affected))
+            force = options.dub_force
+            if ( rebuild and build.exeCacheSize <= 0 ):
+                options.dub_force = True
+            resetFailures()
+            try:
+                nerr = runTests(affected)
+                logNotification("Encountered %d error(s)." % nerr)
+            except SystemExit:
+                logNotification("The run has been aborted.")
+            finally:
+                options.dub_force = force
+            logNotification("Watching for changes ...")
+    except KeyboardInterrupt:
+        logNotification("\nStopped watching.")
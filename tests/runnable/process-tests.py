@@ -4,65 +4,107 @@
 Helper script to execute the various elements of DLBC runnable test suite.
 """
 
-import glob, fnmatch, os, shutil, subprocess, sys
+import glob, os, shutil, subprocess, sys
 
+from dlbct.affected import isAffectedTest, loadAffected
+from dlbct.batch import cleanBatches, executeBatch, isBatchable, planBatches
 from dlbct.build import *
 from dlbct.coverage import cleanCoverage, runUnittests
+from dlbct.h5compare import saveReferenceDigests
+from dlbct.history import estimateTest, loadTimings, longestFirst
+from dlbct.incremental import isUnchangedTest
+from dlbct.index import findTests, selectTests
 from dlbct.latex import *
 from dlbct.logging import *
 from dlbct.plot import *
+from dlbct.results import hasFailedTest, loadLastResults
 from dlbct.run import *
-from dlbct.test import Test
+from dlbct.schedule import Job, Scheduler
+from dlbct.shard import saveShardTimings, selectShard
+from dlbct.watch import watchTests
     
-def processTest(thisTest, options, n, i, singleTest):
-    """ Do everything required for a single test. """
+def isRunning(options):
+    """ Check if tests are run, as opposed to only described, cleaned or plotted. """
+    return not ( options.describe or options.clean or options.timers_clean or options.plot_reference or options.timers_all )
+
+def getSkipReason(thisTest, options):
+    """ Get the reason not to run a test which is enabled, or None if it should be run. """
+    if ( failureLimitReached.is_set() ):
+        return "is not run, the failure limit has been reached"
+    if ( options.shardUnits is not None and not any([ ( thisTest.name, j ) in options.shardUnits for j in range(thisTest.nSubtests) ]) ):
+        return "belongs to another shard, skipping"
+    if ( options.affected_by and not isAffectedTest(options, thisTest) ):
+        return "is not affected by the changes, skipping"
+    if ( options.rerun_failed and not hasFailedTest(options.lastResults, thisTest) ):
+        return "did not fail last time, skipping"
+    return None
+
+def listConfigurations(tests, options, singleTest):
+    """ List the configurations the tests will need an executable for, in the order they are needed. """
+    configurations = []
+    for test in tests:
+        if ( ( test.disabled and not singleTest ) or getSkipReason(test, options) ):
+            continue
+        if ( test.configuration not in configurations ):
+            configurations.append(test.configuration)
+    return configurations
+
+def prepareTest(thisTest, options, n, i, singleTest):
+    """ Do everything required before the parameter sets of a test can be run. Returns True if they should be run. """
 
     # Always execute a test if a json file has been passed explicitly
     if ( singleTest ):
         thisTest.disabled = False
 
-    # Skip the test if it does not have the required tag
-    if ( options.only_tag and ( not options.only_tag in thisTest.tags ) ):
-        thisTest.skipped = True
-        logDebug("Test '%s' does not have the required tag '%s', skipping ..." % ( thisTest.name, options.only_tag ) )
-        return
-
     # If --describe has been passed, only describe the tests
     if ( options.describe ):
         thisTest.describe(n, i)
-        return
+        return False
 
     thisTest.describe(n, i, True)
 
     # Do not do anything for disabled tests
     if ( thisTest.disabled ):
         logNotification("Test '%s' has been disabled, skipping ..." % thisTest.name )
-        return
+        return False
 
     if ( options.timers_clean ):
         cleanTimersData(thisTest)
-        return
+        return False
 
     if ( options.plot_reference ):
         plotTest(thisTest, True)
-        return
+        return False
 
-    cleanTest(thisTest)
     if ( options.clean ):
-        return
+        cleanTest(thisTest)
+        return False
 
-    nerr = 0
+    reason = getSkipReason(thisTest, options)
+    if ( reason ):
+        thisTest.skipped = [ True ] * thisTest.nSubtests
+        logNotification("Test '%s' %s ..." % ( thisTest.name, reason ) )
+        return False
 
     dubBuild(options.dub_compiler, options.dub_build, thisTest.configuration, options.dub_force, options.dlbc_root)
 
+    # The executable is part of the hash, so this can only be checked after building
+    if ( options.incremental and isUnchangedTest(options, thisTest) ):
+        thisTest.skipped = [ True ] * thisTest.nSubtests
+        logNotification("Test '%s' passed last time and is unchanged, skipping ..." % thisTest.name )
+        return False
+
+    cleanTest(thisTest)
+
     # Need to symlink so the .d source files are in the same relative paths as from the DLBC root dir
     if ( options.coverage ):
         if ( not os.path.isdir(os.path.join(thisTest.testRoot, "src"))):
             os.symlink(os.path.join(options.dlbc_root, "src"), os.path.join(thisTest.testRoot, "src"))
 
-    # Run the tests
-    runTest(options, thisTest)
+    return True
 
+def finishTest(thisTest, options):
+    """ Do everything required after all parameter sets of a test have been run. """
     if ( options.coverage ):
         # Clean up the symlink
         os.remove(os.path.join(thisTest.testRoot, "src"))
@@ -70,6 +112,185 @@ def processTest(thisTest, options, n, i, singleTest):
     if ( options.plot ):
         plotTest(thisTest, False)
 
+def processTest(thisTest, options, n, i, singleTest):
+    """ Do everything required for a single test. """
+    if ( prepareTest(thisTest, options, n, i, singleTest) ):
+        runTest(options, thisTest)
+        finishTest(thisTest, options)
+
+def createTestJobs(thisTest, options, n, i, singleTest):
+    """ Split a test into jobs to prepare it, to run and postprocess each of its parameter sets and to finish it. Returns the list of jobs, in order.
+
+    Postprocessing (comparisons) and finishing (plotting) use a core of their own, so they can overlap with the next DLBC runs.
+    """
+    def prepare():
+        thisTest.prepared = prepareTest(thisTest, options, n, i, singleTest)
+
+    # The parameter sets which have been run and are left to postprocess.
+    executed = set()
+
+    def run(j, m):
+        if ( thisTest.prepared and executeParameterSet(options, thisTest, j, m) ):
+            executed.add(j)
+
+    def postprocess(j, m):
+        if ( j in executed ):
+            postprocessParameterSet(options, thisTest, j, m)
+
+    def finish():
+        if ( thisTest.prepared ):
+            finishTest(thisTest, options)
+
+    # Cleaning is cheap and executables are built by jobs of their own, so preparing does not reserve a core.
+    prepareJob = Job(thisTest.name + " (prepare)", 0, prepare)
+    subtestJobs = []
+    postprocessJobs = []
+    for j, m in orderParameterSets(options, thisTest):
+        runJob = Job("%s (run parameter set %d)" % ( thisTest.name, j + 1 ), getSubtestNP(thisTest, m), run, j, m)
+        runJob.stage = "run"
+        runJob.dependsOn(prepareJob)
+        if ( not isIsolated(thisTest) ):
+            # Parameter sets which are not isolated share their output directory.
+            runJob.dependsOn(*postprocessJobs)
+        postprocessJob = Job("%s (postprocess parameter set %d)" % ( thisTest.name, j + 1 ), 1, postprocess, j, m)
+        postprocessJob.stage = "postprocess"
+        postprocessJob.dependsOn(runJob)
+        subtestJobs += [ runJob, postprocessJob ]
+        postprocessJobs.append(postprocessJob)
+    finishJob = Job(thisTest.name + " (finish)", 1, finish)
+    finishJob.dependsOn(*postprocessJobs)
+    return [ prepareJob ] + subtestJobs + [ finishJob ]
+
+def createBatchJobs(tests, options, n, singleTest, buildJobs, lastJobs):
+    """ Create the jobs to run a list of (index, test) whose parameter sets are all short in MPMD batches. Returns the list of jobs.
+
+    Tests in the same directory clean up each other's files, so they are all prepared before the first batch with
+    any of them is launched, and finished after the last one. lastJobs maps test directories to the last job using
+    them, and is updated. Batches are not used for coverage or plots, which need the test directory to themselves.
+    """
+    def prepare(i, test):
+        test.prepared = prepareTest(test, options, n, i, singleTest)
+
+    def run(batch, finished):
+        finished += executeBatch(options, batch)
+
+    def postprocess(finished):
+        for test, j, m, runRoot in finished:
+            postprocessParameterSet(options, test, j, m, runRoot)
+
+    def finish(test):
+        if ( test.prepared ):
+            finishTest(test, options)
+
+    prepareJobs = []
+    for i, test in tests:
+        prepareJob = Job(test.name + " (prepare)", 0, prepare, i, test)
+        if ( test.configuration in buildJobs ):
+            prepareJob.dependsOn(buildJobs[test.configuration])
+        # Tests in the same directory clean the same paths.
+        if ( test.testRoot in lastJobs ):
+            prepareJob.dependsOn(lastJobs[test.testRoot])
+        lastJobs[test.testRoot] = prepareJob
+        prepareJobs.append(prepareJob)
+    batchJobs = []
+    postprocessJobs = {}
+    for k, batch in enumerate(planBatches(options, [ test for i, test in tests ])):
+        finished = []
+        batchJob = Job("batch %d" % ( k + 1 ), sum([ getSubtestNP(test, m) for test, j, m in batch ]), run, batch, finished)
+        batchJob.stage = "run"
+        # The last prepare job of a directory follows all others of the same directory.
+        batchJob.dependsOn(*set([ lastJobs[test.testRoot] for test, j, m in batch ]))
+        postprocessJob = Job("batch %d (postprocess)" % ( k + 1 ), 1, postprocess, finished)
+        postprocessJob.stage = "postprocess"
+        postprocessJob.dependsOn(batchJob)
+        batchJobs += [ batchJob, postprocessJob ]
+        for test, j, m in batch:
+            postprocessJobs.setdefault(test.testRoot, set()).add(postprocessJob)
+    finishJobs = []
+    for i, test in tests:
+        finishJob = Job(test.name + " (finish)", 1, finish, test)
+        finishJob.dependsOn(lastJobs[test.testRoot], *postprocessJobs.get(test.testRoot, []))
+        lastJobs[test.testRoot] = finishJob
+        finishJobs.append(finishJob)
+
+    logNotification("Running %d short tests in %d MPMD batches ..." % ( len(tests), len(batchJobs) // 2 ))
+    return prepareJobs + batchJobs + finishJobs
+
+def runTests(tests, options, singleTest, concurrent):
+    """ Process a list of tests, sorted by path, either concurrently or one after the other. Returns the number of errors. """
+    nerr = 0
+    ntests = len(tests)
+
+    if ( concurrent ):
+        logNotification("Running tests concurrently on %d cores ..." % options.cores)
+        remaining = list(enumerate(tests))
+        batched = []
+        if ( options.batch > 0 and not ( options.coverage or options.plot ) ):
+            batched = [ ( i, test ) for i, test in remaining if isBatchable(options, test) ]
+            remaining = [ ( i, test ) for i, test in remaining if ( i, test ) not in batched ]
+        # Start the tests that took longest before, so they do not end up holding up the rest.
+        ordered = longestFirst(remaining, lambda it: estimateTest(options.timings, it[1]))
+        # Build the executables in the order the tests need them; each test starts as soon as its executable is ready.
+        configurations = listConfigurations([ test for i, test in batched + ordered ], options, singleTest)
+        buildJobs = createBuildJobs(options, configurations)
+        jobs = [ buildJobs[c] for c in configurations if not buildJobs[c].finished ]
+        lastJobs = {}
+        # The batches are run alongside the other tests, each as soon as the tests it contains are prepared.
+        batchJobs = []
+        if ( batched ):
+            batchJobs = createBatchJobs(batched, options, ntests, singleTest, buildJobs, lastJobs)
+        # Tests which share their directory run in scratch directories of their own, so they can run at the same time.
+        # Coverage and plots need the test directory to themselves.
+        shared = {}
+        if ( not ( options.coverage or options.plot ) ):
+            for i, test in ordered:
+                shared[test.testRoot] = shared.get(test.testRoot, 0) + 1
+        sharedJobs = []
+        for i, test in ordered:
+            test.isolated = ( shared.get(test.testRoot, 0) > 1 )
+            testJobs = createTestJobs(test, options, ntests, i, singleTest)
+            if ( test.configuration in buildJobs ):
+                testJobs[0].dependsOn(buildJobs[test.configuration])
+            # Tests in the same directory clean the same paths, so they must not overlap.
+            if ( test.testRoot in lastJobs ):
+                testJobs[0].dependsOn(lastJobs[test.testRoot])
+            if ( test.isolated ):
+                # Only the cleaning is done one test after the other; the runs start once the whole directory is clean.
+                lastJobs[test.testRoot] = testJobs[0]
+                sharedJobs += [ ( test.testRoot, j ) for j in testJobs if j.stage == "run" ]
+            else:
+                lastJobs[test.testRoot] = testJobs[-1]
+            jobs += testJobs
+        for testRoot, job in sharedJobs:
+            job.dependsOn(lastJobs[testRoot])
+        # Let at most as many parameter sets wait for postprocessing as there are cores to process them.
+        try:
+            Scheduler(options.cores, options.cores).run(jobs + batchJobs)
+        finally:
+            if ( batched ):
+                cleanBatches(options)
+        nerr = sum([ sum(test.errors) for test in tests ])
+    else:
+        if ( isRunning(options) ):
+            # Build the executables in the background, while the first tests run.
+            buildAhead(options, listConfigurations(tests, options, singleTest))
+        for i, test in enumerate(tests):
+            if ( options.timers_all ):
+                for compiler in dubCompilerChoices:
+                    options.dub_compiler = compiler
+                    processTest(test, options, ntests, i, singleTest)
+                    nerr += sum(test.errors)
+                plotTimersData(m[0], options.v)
+            elif ( options.timers ):
+                processTest(test, options, ntests, i, singleTest)
+                nerr += sum(test.errors)
+                plotTimersData(m[0], options.v)
+            else:
+                processTest(test, options, ntests, i, singleTest)
+                nerr += sum(test.errors)
+
+    return nerr
+
 def main():
     # Argument parser
     try:
@@ -80,9 +301,16 @@ def main():
 
     parser = argparse.ArgumentParser(description="Helper script to execute the DLBC runnable test suite")
     parser.add_argument("-v", choices=verbosityChoices, default="Information", help="verbosity level of this script [%s]" % ", ".join(verbosityChoices), metavar="")
+    parser.add_argument("--affected-by", help="only run the parameter sets which covered lines changed in this git revision range (e.g. master..HEAD) in their last coverage run", metavar="")
+    parser.add_argument("--batch", type=float, default=0, help="with --jobs, run the tests whose parameter sets all took less than this many seconds last time in combined MPMD launches of mpirun; 0 disables batching", metavar="")
     parser.add_argument("--build-all", action="store_true", help="only build all configurations and build types for the current compiler")
+    parser.add_argument("--build-history", action="store_true", help="only report the trend of the recorded build times, and the builds which were more than --build-regression percent slower than the median of the builds before them")
+    parser.add_argument("--build-jobs", type=int, default=1, help="number of builds to run concurrently, each in its own working directory; with --build-all, or ahead of the tests which need them", metavar="")
+    parser.add_argument("--build-regression", type=float, default=25.0, help="flag builds which take more than this many percent longer than the median of the previous builds of the same executable", metavar="")
     parser.add_argument("--clean", action="store_true", help="only clean tests")
+    parser.add_argument("--compare-jobs", type=int, default=1, help="number of comparisons of a parameter set to run concurrently; each one takes a core on top of the --jobs budget", metavar="")
     parser.add_argument("--compare-lax", action="store_true", help="allow even the dmd compiler to use the accuracy parameter for comparison tests")
+    parser.add_argument("--compare-memory", type=int, default=256, help="total memory ceiling in MB for the in-process comparisons, which is shared by all comparisons that may run at the same time (--jobs times --compare-jobs); each reads the datasets in hyperslabs of at most its share", metavar="")
     parser.add_argument("--compare-none", action="store_true", help="do not run comparison tests")
     parser.add_argument("--compare-strict", action="store_true", help="do not allow non-dmd compilers to use the accuracy parameter for comparison tests")
     parser.add_argument("--coverage", action="store_true", help="generate merged coverage information for unittests and runnable tests")
@@ -93,10 +321,15 @@ def main():
     parser.add_argument("--dub-build", choices=dubBuildChoices, default="release", help="build type to be passed to dub [%s]" % ", ".join(dubBuildChoices), metavar="" )
     parser.add_argument("--dub-compiler", choices=dubCompilerChoices, default="dmd", help="compiler to be passed to dub [%s]" % ", ".join(dubCompilerChoices), metavar="")
     parser.add_argument("--dub-force", action="store_true", help="force dub build")
+    parser.add_argument("--exe-cache-size", type=int, default=4096, help="largest total size in MB of the cache of executables, keyed by a hash of the sources, compiler version and build; 0 disables the cache and reuses any existing executable", metavar="")
+    parser.add_argument("--fail-fast", action="store_true", help="stop after the first failed parameter set, killing the running ones; same as --max-failures 1")
     parser.add_argument("--fast", action="store_true", help="run shorter versions of long tests")
+    parser.add_argument("--incremental", action="store_true", help="skip parameter sets which passed the last time they were run, if their test, input, reference data and executable are unchanged")
+    parser.add_argument("-j", "--jobs", "--cores", type=int, default=1, dest="cores", help="number of cores to run tests on concurrently; tests are packed such that their total number of ranks does not exceed this", metavar="")
     parser.add_argument("--latex", action="store_true", help="only write LaTeX output to stdout")
     parser.add_argument("--log-prefix", action="store_true", help="prefix log messages with the log level")
     parser.add_argument("--log-time", action="store_true", help="prefix log messages with the time")
+    parser.add_argument("--max-failures", type=int, default=0, help="stop after this many failed parameter sets, killing the running ones; 0 means no limit", metavar="")
     parser.add_argument("--only-below", default=".", help="only execute tests below this path", metavar="")
     parser.add_argument("--only-doc", action="store_true", help="only build the documentation")
     parser.add_argument("--only-dmd", default="", help="only continue when using the dmd compiler of the requested version", metavar="")
@@ -105,9 +338,15 @@ def main():
     parser.add_argument("--only-tag", help="only consider tests which have this tag", metavar="")
     parser.add_argument("--plot", action="store_true", help="plot results of the tests")
     parser.add_argument("--plot-reference", action="store_true", help="only plot the reference data of the tests")
+    parser.add_argument("--rerun-failed", action="store_true", help="only run the parameter sets which failed the last time they were run with the same compiler and build type")
+    parser.add_argument("--save-shard-timings", action="store_true", help="only add the most recent run times of the results database to tests/shard-timings.json, which --shard balances the shards by")
+    parser.add_argument("--select", help="only consider tests matching this expression, e.g. \"tag:laplace and configuration:d3* and np>1 and not disabled\"; terms are tag:, name:, configuration: and path: patterns, np and subtests comparisons and disabled, combined with and, or, not and parentheses", metavar="")
+    parser.add_argument("--shard", help="only run shard k of n (given as k/n) of the parameter sets, which are divided into shards of balanced run time by tests/shard-timings.json", metavar="")
+    parser.add_argument("--timeout", type=float, default=0, help="default time limit in seconds for a single parameter set, after which it is killed; 0 means no limit, tests can override this with their timeout parameter", metavar="")
     parser.add_argument("--timers", action="store_true", help="run tests and write timer information and plot")
     parser.add_argument("--timers-all", action="store_true", help="run with all compilers and write timer information and plot")
     parser.add_argument("--timers-clean", action="store_true", help="clean timer data")
+    parser.add_argument("--watch", action="store_true", help="keep watching the DLBC sources and the tests, and rerun the tests affected by each change")
 
     options = parser.parse_args()
 
@@ -119,6 +358,14 @@ def main():
     dlbct.logging.logPrefix = options.log_prefix
     dlbct.logging.logTime = options.log_time
 
+    import dlbct.build
+    dlbct.build.exeCacheSize = options.exe_cache_size * 1024 * 1024
+    dlbct.build.buildRegression = options.build_regression
+
+    import dlbct.h5compare
+    # Every postprocessing job may run --compare-jobs comparisons, and there are at most as many of those as cores.
+    dlbct.h5compare.slabBytes = options.compare_memory * 1024 * 1024 // ( max(1, options.cores) * max(1, options.compare_jobs) )
+
     if ( not isCorrectDMD(options.dub_compiler, options.only_dmd) ):
         logNotification("Compiler is not the requested dmd version (%s), aborting..." % options.only_dmd)
         return
@@ -134,16 +381,20 @@ def main():
             warnTime = 300.0
 
     if ( options.latex ):
-        generateLaTeX(searchRoot)
+        generateLaTeX(options, searchRoot)
         return
 
     if ( options.only_doc ):
         buildDoc(options.dub_compiler, options.dlbc_root)
         return
 
+    if ( options.build_history ):
+        reportBuildHistory(options)
+        return
+
     if ( options.build_all ):
-        buildAll(options)
-        reportBuildTimers(120.0)
+        wallTime = buildAll(options)
+        reportBuildTimers(120.0, wallTime)
         return
 
     if ( options.describe ):
@@ -166,43 +417,64 @@ def main():
             return
         options.dub_build = "cov"
 
-    # Populate list of matching tests.
-    matchingTests = []
-    if ( os.path.isfile(searchRoot) ):
-        testRoot = os.path.dirname(searchRoot)
-        filename = os.path.basename(searchRoot)
-        matchingTests.append(Test(testRoot, filename))
-        singleTest = True
-    else:
-        singleTest = False
-        for testRoot, dirnames, filenames in os.walk(searchRoot):
-            for filename in fnmatch.filter(filenames, '*.json*'):
-                matchingTests.append(Test(testRoot, filename))
+    if ( options.incremental and options.coverage ):
+        logNotification("Coverage information requires all tests to be run, ignoring --incremental ...")
+        options.incremental = False
 
-    nerr = 0
-    ntests = len(matchingTests)
-    for i, test in enumerate(sorted(matchingTests, key=lambda test: test.filePath)):
-        if ( options.timers_all ):
-            for compiler in dubCompilerChoices:
-                options.dub_compiler = compiler
-                processTest(test, options, ntests, i, singleTest)
-                nerr += sum(test.errors)
-            plotTimersData(m[0], options.v)
-        elif ( options.timers ):
-            processTest(test, options, ntests, i, singleTest)
-            nerr += sum(test.errors)
-            plotTimersData(m[0], options.v)
-        else:
-            processTest(test, options, ntests, i, singleTest)
-            nerr += sum(test.errors)
+    if ( options.fail_fast ):
+        options.max_failures = 1
+
+    if ( options.affected_by and not loadAffected(options) ):
+        options.affected_by = None
+
+    options.timings = loadTimings(options)
+    options.lastResults = loadLastResults(options)
+
+    if ( options.save_shard_timings ):
+        saveShardTimings(options)
+        return
+
+    # Only modes which run tests produce timings and benefit from concurrency; the other modes keep their output in order.
+    running = isRunning(options)
+    concurrent = ( running and options.cores > 1 and not options.timers )
+
+    # Tests which are not selected keep their index entry; --describe needs nothing else.
+    matchingTests, singleTest = findTests(options, searchRoot)
+    matchingTests, selectedTests = selectTests(options, matchingTests, not options.describe)
+
+    options.shardUnits = None
+    if ( options.watch and running ):
+        def runChangedTests(tests):
+            options.timings = loadTimings(options)
+            options.lastResults = loadLastResults(options)
+            try:
+                nerr = runTests(tests, options, singleTest, concurrent)
+            finally:
+                saveReferenceDigests(options.dlbc_root)
+            reportRunTimers(tests, warnTime)
+            return nerr
+        watchTests(options, searchRoot, runChangedTests)
+        return
+
+    if ( options.shard and running ):
+        options.shardUnits = selectShard(options, selectedTests, singleTest)
+
+    try:
+        nerr = runTests(selectedTests, options, singleTest, concurrent)
+    finally:
+        # The digests of the reference data computed during the run are written once, even if it is cut short.
+        saveReferenceDigests(options.dlbc_root)
 
     if ( options.describe ):
         return
 
-    # reportRunTimers(matchingTests + unittests, warnTime)
+    if ( running ):
+        reportRunTimers(matchingTests + unittests, warnTime)
 
     # Final report
     logNotification("\n" + "="*80)
+    if ( failureLimitReached.is_set() ):
+        logNotification("Stopped after %d failed parameter set(s), the remaining ones have not been run." % options.max_failures)
     if ( nerr > 0 ):
         if ( nerr == 1 ):
             logFatal("Encountered %d error." % nerr, -1)
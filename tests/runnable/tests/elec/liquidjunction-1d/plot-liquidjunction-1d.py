@@ -4,6 +4,8 @@
 from mplhelper import *
 #### END HEADER
 
+from catalog import Catalog
+
 rcParams['figure.subplot.top'] = 0.93
 rcParams['figure.subplot.right'] = 0.93
 
@@ -68,8 +70,8 @@ dpsi_theor = []
 
 L = 128.0
 
-def add_dataset(globstr, t):
-    g = sorted(glob.glob(globstr))
+def add_dataset(pattern, t):
+    g = catalog.match(pattern)
     if ( len(g) != 1 ) : return
     f = h5py.File(g[0], 'r')
     phi = f["/OutArray"][:]
@@ -79,13 +81,16 @@ def add_dataset(globstr, t):
     dpsi_theor.append(DeltaPsi(t))
     tx_theor.append(t)
 
+# List the output once instead of globbing it for each of the timesteps.
+catalog = Catalog(options.relpath)
+
 stride = 100
 for t in irange(0,10000,stride):
-    add_dataset(os.path.join(options.relpath, "elPot*-t%08d.h5" % t), t)
+    add_dataset("elPot*-t%08d.h5" % t, t)
 
 stride = 1000
 for t in irange(11000,100000,stride):
-    add_dataset(os.path.join(options.relpath, "elPot*-t%08d.h5" % t), t)
+    add_dataset("elPot*-t%08d.h5" % t, t)
 
 
 if (len(tx_theor) == 0):